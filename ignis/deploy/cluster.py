@@ -0,0 +1,205 @@
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ignis.deploy.utils as utils
+
+MODULE_NAME = "cluster"
+SERVICES = ["registry", "registry-ui", "nomad", "zookeeper", "mesos", "submitter"]
+
+
+class _Step:
+    def __init__(self, host, target, service, options):
+        self.host = host
+        self.target = target
+        self.service = service
+        self.after = options.pop("after", [])
+        self.options = options
+        self.argv = []
+        self.dependencies = []
+        self.level = 0
+
+    def __str__(self):
+        return self.host + "/" + self.service
+
+
+def apply(spec_file, service_parsers, dry_run, timeout):
+    import yaml
+    with open(spec_file) as file:
+        spec = yaml.safe_load(file) or {}
+
+    steps = _steps(spec, service_parsers)
+    _dependencies(steps)
+    levels = _levels(steps)
+
+    print("Plan:")
+    for level, level_steps in enumerate(levels):
+        print("  " + str(level) + ": " + ", ".join(map(str, level_steps)))
+        if dry_run:
+            for step in level_steps:
+                print("       " + str(step) + ": " + _command(step))
+    if dry_run:
+        return
+
+    lock = threading.Lock()
+    futures = dict()
+    start = time.time()
+
+    def run(step):
+        for dependency in step.dependencies:
+            if not futures[dependency].result():
+                with lock:
+                    print("warn: " + str(step) + " skipped, " + str(dependency) + " failed")
+                return False
+        t0 = time.time()
+        try:
+            output = _execute(step.target, [step.service, "start"] + step.argv + ["--wait", str(timeout)])
+        except Exception as ex:
+            with lock:
+                print("error: " + str(step) + " " + str(ex))
+            return False
+        with lock:
+            for line in output.splitlines():
+                print("  " + str(step) + ": " + line)
+            print("info: " + str(step) + " ready in " + "{:.1f}s".format(time.time() - t0))
+        return True
+
+    with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+        for level_steps in levels:
+            for step in level_steps:
+                futures[step] = pool.submit(run, step)
+        failed = [step for step in steps if not futures[step].result()]
+
+    if failed:
+        print("error: " + ", ".join(map(str, failed)) + " not deployed")
+        exit(-1)
+    print("info: cluster ready in " + "{:.1f}s".format(time.time() - start))
+
+
+def _steps(spec, service_parsers):
+    defaults = spec.get("defaults") or {}
+    hosts = spec.get("hosts") or {}
+    if not hosts:
+        raise RuntimeError("cluster spec without hosts")
+    steps = list()
+    for host, host_spec in hosts.items():
+        host_spec = host_spec or {}
+        target = host_spec.get("ssh", host)
+        for service, options in (host_spec.get("services") or {}).items():
+            if service not in SERVICES:
+                raise RuntimeError(host + ": unknown service " + service)
+            step = _Step(str(host), target, service, dict(options or {}))
+            parser, options = _startParser(service, service_parsers[service])
+            step.argv = _argv(step, parser, options, defaults)
+            steps.append(step)
+    return steps
+
+
+def _startParser(service, service_parser):
+    options = dict()
+
+    class Parser(argparse.ArgumentParser):
+        # Subparsers are created with the class of their parent, so every action parser records its options
+        def add_argument(self, *args, **kwargs):
+            options.setdefault(self.prog.split()[-1], set()).update(arg for arg in args if arg.startswith("-"))
+            return argparse.ArgumentParser.add_argument(self, *args, **kwargs)
+
+    parser = Parser(prog="ignis-deploy " + service)
+    service_parser(parser)
+    return parser, options["start"]
+
+
+def _argv(step, parser, options, defaults):
+    argv = list()
+    items = [(key, value, True) for key, value in defaults.items()] + \
+            [(key, value, False) for key, value in step.options.items()]
+    for key, value, default in items:
+        key = str(key).replace("_", "-")
+        option = next(filter(lambda opt: opt in options, ["--" + key, "-" + key]), None)
+        if option is None:
+            if default:
+                continue
+            raise RuntimeError(str(step) + ": unknown option " + key)
+        if value is None or value is False:
+            continue
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            argv.append(option)
+            argv.extend(map(str, value))
+        else:
+            argv.extend([option, str(value)])
+    try:
+        parser.parse_args(["start"] + argv)
+    except SystemExit:
+        raise RuntimeError(str(step) + ": invalid options " + " ".join(argv))
+    return argv
+
+
+def _dependencies(steps):
+    by_name = {str(step): step for step in steps}
+    addresses = dict()
+    for step in steps:
+        addresses[(step.host, step.service)] = step
+        addresses[(step.target.split("@")[-1], step.service)] = step
+        bind = step.options.get("bind", step.options.get("b"))
+        if bind:
+            addresses[(str(bind), step.service)] = step
+
+    for step in steps:
+        dependencies = list()
+        if step.service != "registry":
+            dependencies += [other for other in steps if other.service == "registry"]
+        if step.service == "mesos":
+            dependencies += [other for other in steps if other.service == "zookeeper"]
+        partner = step.options.get("partner") or step.options.get("join") or \
+                  (step.options.get("partnerall") or [None])[0]
+        if partner and (str(partner).split(":")[0], step.service) in addresses:
+            dependencies.append(addresses[(str(partner).split(":")[0], step.service)])
+        for name in step.after:
+            if name not in by_name:
+                raise RuntimeError(str(step) + ": unknown dependency " + name)
+            dependencies.append(by_name[name])
+        step.dependencies = list(dict.fromkeys(filter(lambda dep: dep is not step, dependencies)))
+
+
+def _levels(steps):
+    levels = list()
+    done = set()
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if all(dep in done for dep in step.dependencies)]
+        if not ready:
+            raise RuntimeError("dependency cycle between " + ", ".join(map(str, pending)))
+        for step in ready:
+            step.level = len(levels)
+        levels.append(ready)
+        done.update(ready)
+        pending = [step for step in pending if step not in done]
+    return levels
+
+
+def _isLocal(target):
+    return target in ("local", "localhost", utils.getHostname())
+
+
+def _command(step):
+    return "ignis-deploy " + shlex.join([step.service, "start"] + step.argv) + \
+           ("" if _isLocal(step.target) else " (ssh " + step.target + ")")
+
+
+def _execute(target, argv):
+    if _isLocal(target):
+        cmd = [sys.executable, "-m", "ignis.deploy.deploy"] + argv
+    else:
+        cmd = ["ssh", "-o", "BatchMode=yes", target, "ignis-deploy " + shlex.join(argv)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=os.environ.copy())
+    output = result.stdout.decode("utf-8", errors="replace")
+    if result.returncode != 0:
+        raise RuntimeError("failed:\n" + output)
+    return output
@@ -1,46 +1,376 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
 import sys
 
-import ignis.deploy.images as images
-import ignis.deploy.mesos as mesos
-import ignis.deploy.nomad as nomad
-import ignis.deploy.registry as registry
-import ignis.deploy.registry_ui as registry_ui
-import ignis.deploy.submitter as submitter
-import ignis.deploy.zookeeper as zookeeper
 import ignis.deploy.version as version
 
 
 def cli():
+    # Only the parser of the selected service is built, the others would import their modules for nothing
+    selector = argparse.ArgumentParser(add_help=False)
+    selector.add_argument('service', nargs='?')
+    service = selector.parse_known_args()[0].service
+
     # Interface
     parser = argparse.ArgumentParser(prog="ignis-deploy", description='Script for the deploy of an Ignis cluster')
     subparsers = parser.add_subparsers(dest='service', help="Available services")
 
-    # Common
-    def common_arguments(parser, force=False, clear=False, registry=False, namespace=False, tag=False):
-        if force:
-            parser.add_argument('-f', '--force', dest='force', action='store_true',
-                                help='Destroy container if exists')
-        if clear:
-            parser.add_argument('-c', '--clear', dest='clear', action='store_true',
-                                help='Clear all previous data')
-        if registry:
-            parser.add_argument('--docker-registry', dest='registry', action='store', metavar='url',
-                                help='Docker image registry', default=None)
-        if namespace:
-            parser.add_argument('--docker-namespace', dest='namespace', action='store', metavar='name',
-                                help='Docker image namespace', default="ignishpc")
-        if tag:
-            parser.add_argument('--docker-tag', dest='tag', action='store', metavar='tag',
-                                help='Docker image tag', default="")
-
     subparsers.add_parser("version", description='Show version and exits')
-    subparsers.add_parser("status", description='Check modules status')
-    # Registry
-    parser_rty = subparsers.add_parser(registry.MODULE_NAME, description='Image registry')
+    parser_status = subparsers.add_parser("status", description='Check modules status')
+    parser_status.add_argument('--json', dest='json', action='store_true',
+                               help='Print the status and health probes as json')
+    parser_status.add_argument('--watch', dest='watch', action='store_true',
+                               help='Keep running and print container state transitions (start, die, oom, health) '
+                                    'as they happen')
+    parser_status.add_argument('--timeout', dest='timeout', action='store', metavar='seconds', type=float,
+                               help='Health probe timeout, default 5', default=5)
+    parser_apply = subparsers.add_parser("apply", description='Deploy the services of a YAML cluster spec, '
+                                                               'independent services are started in parallel')
+    parser_apply.add_argument('spec', action='store', metavar='file',
+                              help='YAML cluster spec')
+    parser_apply.add_argument('--dry-run', dest='dry_run', action='store_true',
+                              help='Only show the bring-up plan')
+    parser_apply.add_argument('--timeout', dest='timeout', action='store', metavar='seconds', type=float,
+                              help='Time to wait for each service to be ready, default 300', default=300)
+    for name, description, service_parser in SERVICES:
+        parser_service = subparsers.add_parser(name, description=description)
+        if name == service:
+            service_parser(parser_service)
+
+    args = parser.parse_args(['-h'] if len(sys.argv) == 1 else None)
+    if args.service == "version":
+        print(version.__version__)
+        exit(0)
+
+    if "action" in args and not args.action:
+        subparsers.choices[args.service].print_help()
+        sys.exit(0)
+
+    if args.service == "apply":
+        import ignis.deploy.cluster as cluster
+        cluster.apply(spec_file=args.spec,
+                      service_parsers={name: service_parser for name, _, service_parser in SERVICES},
+                      dry_run=args.dry_run,
+                      timeout=args.timeout)
+        return
+
+    # Service modules import docker, they are only loaded when the selected service needs them
+    import ignis.deploy.registry as registry
+
+    if args.service == "status":
+        import ignis.deploy.health as health
+        import ignis.deploy.mesos as mesos
+        import ignis.deploy.nomad as nomad
+        import ignis.deploy.registry_ui as registry_ui
+        import ignis.deploy.submitter as submitter
+        import ignis.deploy.zookeeper as zookeeper
+        if args.watch:
+            import ignis.deploy.utils as utils
+            client = utils.getClient()
+            health.watch(client, utils.getContainers(client), args.json)
+            return
+        services = [
+            ("Registry", registry.status(), registry.probes()),
+            ("Proxy", registry.status(proxy=True), registry.probes(proxy=True)),
+            ("Registry-ui", registry_ui.status(), registry_ui.probes()),
+            ("Nomad", nomad.status(), nomad.probes()),
+            ("Zookeeper", zookeeper.status(), zookeeper.probes()),
+            ("Mesos", mesos.status(), mesos.probes()),
+            ("Submitter", submitter.status(), submitter.probes()),
+        ]
+        result = health.check(services, args.timeout)
+        if args.json:
+            print(json.dumps(result, indent=4))
+            return
+        print("Service Status:")
+        for service in result:
+            print(service["service"].rjust(12) + "  " + service["status"])
+            for probe in service["probes"]:
+                print(" " * 14 + probe["probe"].ljust(20) + ("OK" if probe["healthy"] else "FAIL").ljust(6) +
+                      (str(probe["latency_ms"]) + "ms").rjust(10) + "  " + probe["detail"])
+        if any(service["healthy"] is False for service in result):
+            exit(1)
+        return
+
+    default_registry = registry.parse(args.registry if "registry" in args else None)
+    namespace = args.namespace if "namespace" in args else ""
+    img_tag = args.tag if "tag" in args else ""
+    if len(namespace) > 0 and namespace[-1] != "/":
+        namespace += "/"
+    if len(img_tag) > 0 and img_tag[0] != ':':
+        img_tag = ":" + img_tag
+    url_namespace = default_registry + namespace
+
+    if args.service == "registry":
+        if args.action == "start":
+            registry.start(bind=args.bind,
+                           port=args.port,
+                           path=args.path,
+                           default=args.default,
+                           proxy=args.proxy,
+                           proxy_ttl=args.proxy_ttl,
+                           proxy_user=args.proxy_user,
+                           cache=args.cache if args.redis is None else "redis",
+                           redis=args.redis,
+                           redis_pool=args.redis_pool,
+                           redis_memory=args.redis_memory,
+                           upload_purging=args.upload_purging,
+                           max_threads=args.max_threads,
+                           clear=args.clear,
+                           force=args.force,
+                           wait=args.wait)
+        elif args.action == "garbage":
+            registry.garbage(keep=args.keep,
+                             keep_versions=args.keep_versions,
+                             dry_run=args.dry_run,
+                             proxy=args.proxy)
+        elif args.action == "bench":
+            registry.bench(urls=args.urls,
+                           layers=args.layers,
+                           clients=args.clients,
+                           iterations=args.pulls,
+                           repo=args.repository)
+        elif args.action == "stop":
+            registry.stop(proxy=args.proxy)
+        elif args.action == "resume":
+            registry.resume(proxy=args.proxy)
+        elif args.action == "destroy":
+            registry.destroy(proxy=args.proxy)
+    elif args.service == "registry-ui":
+        import ignis.deploy.registry_ui as registry_ui
+        if args.action == "start":
+            registry_ui.start(port=args.port,
+                              registry=default_registry,
+                              force=args.force,
+                              wait=args.wait)
+        elif args.action == "stop":
+            registry.stop()
+        elif args.action == "resume":
+            registry.resume()
+        elif args.action == "destroy":
+            registry.destroy()
+    elif args.service == "nomad":
+        import ignis.deploy.nomad as nomad
+        if args.action == "start":
+            nomad.start(bind=args.bind,
+                        partner=args.partner,
+                        ports=args.ports,
+                        password=args.password,
+                        config_file=args.config,
+                        name=args.name,
+                        data=args.data,
+                        no_client=args.no_client,
+                        no_server=args.no_server,
+                        docker_bin=args.docker_bin,
+                        volumes=args.volumes,
+                        url_namespace=url_namespace,
+                        img_tag=img_tag,
+                        force=args.force,
+                        clear=args.clear,
+                        wait=args.wait)
+        elif args.action == "stop":
+            nomad.stop()
+        elif args.action == "resume":
+            nomad.resume()
+        elif args.action == "destroy":
+            nomad.destroy()
+    elif args.service == "zookeeper":
+        import ignis.deploy.zookeeper as zookeeper
+        if args.action == "start":
+            zookeeper.start(bind=args.bind,
+                            id=args.id,
+                            partner=args.partner,
+                            members=args.members,
+                            observer=args.observer,
+                            password=args.password,
+                            ports=args.ports,
+                            logs=args.logs,
+                            conf=args.conf,
+                            data=args.data,
+                            data_log=args.data_log,
+                            heap=args.heap,
+                            snap_count=args.snap_count,
+                            prealloc_size=args.prealloc_size,
+                            outstanding_limit=args.outstanding_limit,
+                            autopurge=args.autopurge,
+                            metrics_port=args.metrics_port,
+                            endpoint=args.endpoint,
+                            url_namespace=url_namespace,
+                            img_tag=img_tag,
+                            clear=args.clear,
+                            force=args.force,
+                            wait=args.wait)
+        elif args.action == "stop":
+            zookeeper.stop()
+        elif args.action == "resume":
+            zookeeper.resume()
+        elif args.action == "leave":
+            zookeeper.leave(password=args.password)
+        elif args.action == "bench":
+            zookeeper.bench(server=args.server,
+                            clients=args.clients,
+                            operations=args.operations,
+                            size=args.size,
+                            workloads=args.workloads.split(","),
+                            output_json=args.json)
+        elif args.action == "stats":
+            zookeeper.stats(server=args.server,
+                            output_json=args.json)
+        elif args.action == "destroy":
+            zookeeper.destroy()
+    elif args.service == "mesos":
+        import ignis.deploy.mesos as mesos
+        if args.action == "start":
+            mesos.start(service=args.mesos_service,
+                        bind=args.bind,
+                        quorum=args.quorum,
+                        name=args.name,
+                        zookeeper=args.zookeeper,
+                        resources=args.resources,
+                        reserved_cpus=args.reserved_cpus,
+                        reserved_mem=args.reserved_mem,
+                        reserved_disk=args.reserved_disk,
+                        attributes=args.attributes,
+                        port_master=args.port_master,
+                        port_agent=args.port_agent,
+                        port_service=args.port_service,
+                        no_agent=args.no_agent,
+                        data=args.data,
+                        sandbox=args.sandbox,
+                        fetcher_cache_size=args.fetcher_cache_size,
+                        fetcher_cache_dir=args.fetcher_cache_dir,
+                        image_gc_headroom=args.image_gc_headroom,
+                        gc_disk_headroom=args.gc_disk_headroom,
+                        preload=args.preload,
+                        docker_bin=args.docker_bin,
+                        default_registry=default_registry,
+                        url_namespace=url_namespace,
+                        img_tag=img_tag,
+                        clear=args.clear,
+                        force=args.force,
+                        wait=args.wait,
+                        )
+        elif args.action == "stop":
+            mesos.stop()
+        elif args.action == "resume":
+            mesos.resume()
+        elif args.action == "destroy":
+            mesos.destroy()
+    elif args.service == "submitter":
+        import ignis.deploy.submitter as submitter
+        if args.action == "start":
+            submitter.start(port=args.port,
+                            dfs=args.dfs,
+                            dfs_home=args.dfs_home,
+                            password=args.password,
+                            scheduler=args.scheduler[0],
+                            shceduler_url=args.scheduler[1],
+                            dns=args.dns,
+                            envs=args.envs,
+                            mounts=args.mounts,
+                            default_registry=default_registry,
+                            url_namespace=url_namespace,
+                            img_tag=img_tag,
+                            force=args.force,
+                            wait=args.wait)
+        elif args.action == "stop":
+            submitter.stop()
+        elif args.action == "resume":
+            submitter.resume()
+        elif args.action == "destroy":
+            submitter.destroy()
+    elif args.service == "images":
+        import ignis.deploy.images as images
+        if args.action == "clear":
+            images.clear(yes=args.yes,
+                         version=args.version,
+                         whitelist=args.whitelist,
+                         blacklist=args.blacklist,
+                         add_none=args.add_none,
+                         force=args.force,
+                         default_registry=default_registry,
+                         namespace=namespace)
+        elif args.action == "push":
+            images.push(yes=args.yes,
+                        builders=args.builders,
+                        version=args.version,
+                        whitelist=args.whitelist,
+                        blacklist=args.blacklist,
+                        default_registry=default_registry,
+                        namespace=namespace)
+        elif args.action == "build":
+            images.build(sources=args.sources,
+                         local_sources=args.local_sources,
+                         ignore_folders=args.ignore_folders,
+                         version_filters=args.version_filters,
+                         custom_images=args.custom_images,
+                         bases=args.bases,
+                         full=args.full,
+                         save_logs=args.logs,
+                         version_tags=args.version_tags,
+                         version=args.version,
+                         default_registry=default_registry,
+                         namespace=namespace,
+                         platform=args.platform,
+                         platform_builders=args.platform_builders,
+                         legacy=args.legacy,
+                         build_hosts=args.build_hosts,
+                         pull=args.pull)
+        elif args.action == "singularity":
+            images.singularity(name=args.image,
+                               output=args.output,
+                               host=args.host,
+                               default_registry=default_registry,
+                               platform=args.platform,
+                               force=args.force)
+        elif args.action == "analyze":
+            images.analyze(version=args.version,
+                           compare=args.compare,
+                           whitelist=args.whitelist,
+                           blacklist=args.blacklist,
+                           top=args.top,
+                           threshold=args.threshold,
+                           default_registry=default_registry,
+                           namespace=namespace)
+        elif args.action == "save":
+            images.save(output=args.output,
+                        builders=args.builders,
+                        version=args.version,
+                        whitelist=args.whitelist,
+                        blacklist=args.blacklist,
+                        level=args.level,
+                        jobs=args.jobs,
+                        force=args.force,
+                        default_registry=default_registry,
+                        namespace=namespace)
+        elif args.action == "sync":
+            images.sync(source=args.source,
+                        destination=args.destination,
+                        version=args.version,
+                        jobs=args.jobs,
+                        namespace=namespace)
+        elif args.action == "distribute":
+            nodes = list(args.nodes)
+            if args.nomad:
+                import ignis.deploy.nomad as nomad
+                nodes += nomad.nodes(args.nomad)
+            if args.mesos:
+                import ignis.deploy.mesos as mesos
+                nodes += mesos.agents(args.mesos)
+            images.distribute(names=args.images,
+                              nodes=nodes,
+                              endpoint=args.endpoint,
+                              jobs=args.jobs,
+                              default_registry=default_registry)
+        elif args.action == "load":
+            images.load(bundle=args.bundle,
+                        jobs=args.jobs)
+
+
+def _registryParser(parser_rty):
     subparsers_rty = parser_rty.add_subparsers(dest='action', help="Registry service actions")
 
     rty_start = subparsers_rty.add_parser("start", description='Start a registry service')
@@ -52,29 +382,76 @@ def cli():
     rty_start.add_argument('--port', dest='port', action='store', metavar='int', type=int,
                            help='Registry server Port, default 5000')
     rty_start.add_argument('--path', dest='path', action='store', metavar='str',
-                           help='File System path to store the registry contents, default /var/lib/ignis/registry')
-    common_arguments(rty_start, force=True, clear=True)
+                           help='File System path to store the registry contents, default /var/lib/ignis/registry '
+                                '(/var/lib/ignis/registry-proxy with --proxy)')
+    rty_start.add_argument('--proxy', dest='proxy', action='store', metavar='url',
+                           help='Start a pull-through cache of the upstream registry url (e.g. '
+                                'https://registry-1.docker.io) instead of a registry, default port 5001')
+    rty_start.add_argument('--proxy-ttl', dest='proxy_ttl', action='store', metavar='duration',
+                           help='Expiration time of the cached contents (e.g. 168h), default 168h')
+    rty_start.add_argument('--proxy-user', dest='proxy_user', action='store', nargs=2, metavar=('user', 'password'),
+                           help='Credentials of the upstream registry')
+    rty_start.add_argument('--cache', dest='cache', action='store', choices=["inmemory", "redis"],
+                           help='Blob descriptor cache, redis starts a local redis container unless --redis is used, '
+                                'default inmemory (the registry image configuration)')
+    rty_start.add_argument('--redis', dest='redis', action='store', metavar='address',
+                           help='Use an existing redis server (host:port) as blob descriptor cache')
+    rty_start.add_argument('--redis-pool', dest='redis_pool', action='store', nargs=2, type=int,
+                           metavar=('maxidle', 'maxactive'), help='Redis connection pool size')
+    rty_start.add_argument('--redis-memory', dest='redis_memory', action='store', metavar='size',
+                           help='Memory limit of the local redis container, default 512mb')
+    rty_start.add_argument('--upload-purging', dest='upload_purging', action='store', nargs=2,
+                           metavar=('age', 'interval'),
+                           help='Purge uploads older than age every interval (e.g. 24h 1h), use "off 0" to disable, '
+                                'default 168h 24h')
+    rty_start.add_argument('--max-threads', dest='max_threads', action='store', metavar='int', type=int,
+                           help='Maximum concurrent filesystem operations of the storage driver, default 100')
+    common_arguments(rty_start, force=True, clear=True, wait=True)
 
     rty_garbage = subparsers_rty.add_parser("garbage", description='Run registry garbage collection')
+    rty_garbage.add_argument('--keep', dest='keep', action='store', metavar='int', type=int,
+                             help='Delete the manifests of all but the newest N versions of each repository, '
+                                  'platform tags and manifest lists are kept or deleted together (latest is always '
+                                  'kept) before collecting, default delete nothing')
+    rty_garbage.add_argument('--keep-version', dest='keep_versions', action='append', metavar='version',
+                             help='Version that is never deleted by --keep', default=[])
+    rty_garbage.add_argument('--dry-run', dest='dry_run', action='store_true',
+                             help='Only report what would be deleted')
+    rty_bench = subparsers_rty.add_parser("bench", description='Measure registry pull throughput and latency')
+    rty_bench.add_argument('--url', dest='urls', action='append', metavar='url',
+                           help='Registry to measure, use it several times to compare configurations, default the '
+                                'registry service', default=[])
+    rty_bench.add_argument('--layers', dest='layers', nargs='+', metavar='size',
+                           help='Sizes of the synthetic image layers, default 1MB 10MB', default=["1MB", "10MB"])
+    rty_bench.add_argument('--clients', dest='clients', action='store', metavar='int', type=int,
+                           help='Concurrent clients, default 16', default=16)
+    rty_bench.add_argument('--pulls', dest='pulls', action='store', metavar='int', type=int,
+                           help='Image pulls per client, default 10', default=10)
+    rty_bench.add_argument('--repository', dest='repository', action='store', metavar='name',
+                           help='Repository used for the synthetic image, default ignis-bench/bench',
+                           default="ignis-bench/bench")
     rty_stop = subparsers_rty.add_parser("stop", description='Stop the registry service')
     rty_resume = subparsers_rty.add_parser("resume", description='Resume the registry service')
     rty_destroy = subparsers_rty.add_parser("destroy", description='Destroy the registry service')
+    for rty_action in (rty_garbage, rty_stop, rty_resume, rty_destroy):
+        rty_action.add_argument('--proxy', dest='proxy', action='store_true',
+                                help='Select the pull-through cache instead of the registry')
 
-    # Registry-ui
-    parser_rty_ui = subparsers.add_parser(registry_ui.MODULE_NAME, description='Image registry-ui')
+
+def _registryUiParser(parser_rty_ui):
     subparsers_rty_ui = parser_rty_ui.add_subparsers(dest='action', help="Registry-ui service actions")
 
     rty_ui_start = subparsers_rty_ui.add_parser("start", description='Start a registry-ui service')
     rty_ui_start.add_argument('--port', dest='port', action='store', metavar='int', type=int,
                               help='Registry-ui server Port, default 3000')
-    common_arguments(rty_ui_start, clear=True, force=True)
+    common_arguments(rty_ui_start, clear=True, force=True, wait=True)
 
     rty_ui_stop = subparsers_rty_ui.add_parser("stop", description='Stop the registry-ui service')
     rty_ui_resume = subparsers_rty_ui.add_parser("resume", description='Resume the registry-ui service')
     rty_ui_destroy = subparsers_rty_ui.add_parser("destroy", description='Destroy the registry-ui service')
 
-    # Nomad parser
-    parser_nomad = subparsers.add_parser(nomad.MODULE_NAME, description='Nomad cluster')
+
+def _nomadParser(parser_nomad):
     subparsers_nomad = parser_nomad.add_subparsers(dest='action', help="Nomad service actions")
 
     nomad_start = subparsers_nomad.add_parser("start", description='Start a Nomad service')
@@ -101,14 +478,14 @@ def cli():
                              help='Docker binary, default /usr/bin/docker')
     nomad_start.add_argument('--volumes', dest='volumes', metavar='path',
                              nargs="*", help='Allow mount host path as volume', default=[])
-    common_arguments(nomad_start, force=True, clear=True, registry=True, namespace=True, tag=True)
+    common_arguments(nomad_start, force=True, clear=True, registry=True, namespace=True, tag=True, wait=True)
 
     nomad_stop = subparsers_nomad.add_parser("stop", description='Stop the Nomad service')
     nomad_resume = subparsers_nomad.add_parser("resume", description='Resume the Nomad service')
     nomad_destroy = subparsers_nomad.add_parser("destroy", description='Destroy the Nomad service')
 
-    # Zookeper parser
-    parser_zk = subparsers.add_parser(zookeeper.MODULE_NAME, description='Zookeeper cluster')
+
+def _zookeeperParser(parser_zk):
     subparsers_zk = parser_zk.add_subparsers(dest='action', help="Zookeeper service actions")
 
     zk_start = subparsers_zk.add_parser("start", description='Start a Zookeeper service')
@@ -121,6 +498,15 @@ def cli():
                           help='Join to a existing zookeeper cluster')
     zk_start.add_argument('--partnerall', dest='partner', nargs=5, metavar=('address', 'id', 'port', 'port', 'port'),
                           help='Join to a existing zookeeper cluster with a custom configuration')
+    zk_start.add_argument('--members', dest='members', nargs='+', metavar='[id=]address',
+                          help='Start a new ensemble with all these servers in parallel, each server is created '
+                               'through its docker endpoint')
+    zk_start.add_argument('--observer', dest='observer', action='store_true',
+                          help='Join as a non-voting observer that serves reads without enlarging the write quorum, '
+                               'use address:observer in --members for the same')
+    zk_start.add_argument('--endpoint', dest='endpoint', action='store', metavar='format', default='tcp://{}:2375',
+                          help='Docker endpoint of the --members servers, {} is replaced with the address, '
+                               'default tcp://{}:2375')
     zk_start.add_argument('--password', dest='password', action='store', metavar='str',
                           help='Zookeeper super-user password for add new nodes, default random')
     zk_start.add_argument('--logs', dest='logs', action='store', metavar='path',
@@ -131,14 +517,54 @@ def cli():
                           help='Conf directory, default /etc/ignis/zookeeper')
     zk_start.add_argument('-p', '--ports', dest='ports', nargs=3, metavar='int', type=int,
                           help='Ports used by zookeper services, default 2888 3888 2181')
-    common_arguments(zk_start, force=True, clear=True, registry=True, namespace=True, tag=True)
+    zk_start.add_argument('--data-log', dest='data_log', action='store', metavar='path',
+                          help='Transaction log directory, use a dedicated low-latency disk, default inside --data')
+    zk_start.add_argument('--heap', dest='heap', action='store', metavar='size',
+                          help='JVM heap size (e.g. 2g), default auto: a quarter of the host memory between 512m '
+                               'and 8g')
+    zk_start.add_argument('--snap-count', dest='snap_count', action='store', metavar='int', type=int,
+                          help='Transactions logged between snapshots, default 100000')
+    zk_start.add_argument('--prealloc-size', dest='prealloc_size', action='store', metavar='size',
+                          help='Transaction log file preallocation (e.g. 64m), default 64m')
+    zk_start.add_argument('--outstanding-limit', dest='outstanding_limit', action='store', metavar='int', type=int,
+                          help='Maximum queued requests before throttling clients, default 1000')
+    zk_start.add_argument('--autopurge', dest='autopurge', action='store', nargs=2, type=int,
+                          metavar=('snapshots', 'hours'),
+                          help='Snapshots kept and purge interval, 0 hours disables it, default 3 24')
+    zk_start.add_argument('--metrics-port', dest='metrics_port', action='store', metavar='int', type=int,
+                          help='Enable the Prometheus metrics provider on this port (e.g. 7000), default disabled')
+    common_arguments(zk_start, force=True, clear=True, registry=True, namespace=True, tag=True, wait=True)
 
     zk_stop = subparsers_zk.add_parser("stop", description='Stop the Zookeeper service')
     zk_resume = subparsers_zk.add_parser("resume", description='Resume the Zookeeper service')
     zk_destroy = subparsers_zk.add_parser("destroy", description='Destroy the Zookeeper service')
-
-    # Mesos parser
-    parser_mesos = subparsers.add_parser(mesos.MODULE_NAME, description='Mesos cluster')
+    zk_stats = subparsers_zk.add_parser("stats", description='Summarize latency, outstanding requests, znodes and '
+                                                             'fsync time of every ensemble server')
+    zk_stats.add_argument('--server', dest='server', action='store', metavar='address[:port]',
+                          help='Any ensemble server client address, default the local server')
+    zk_stats.add_argument('--json', dest='json', action='store_true',
+                          help='Print the stats as json')
+    zk_bench = subparsers_zk.add_parser("bench", description='Measure throughput and latency of create, set, get '
+                                                             'and delete requests with concurrent sessions')
+    zk_bench.add_argument('--server', dest='server', action='store', metavar='address[:port]',
+                          help='Ensemble server client address, default the local server')
+    zk_bench.add_argument('--clients', dest='clients', action='store', metavar='int', type=int, default=8,
+                          help='Concurrent sessions, default 8')
+    zk_bench.add_argument('--operations', dest='operations', action='store', metavar='int', type=int, default=1000,
+                          help='Requests per session and workload, default 1000')
+    zk_bench.add_argument('--size', dest='size', action='store', metavar='size', default="100",
+                          help='Znode data size, default 100 bytes')
+    zk_bench.add_argument('--workloads', dest='workloads', action='store', metavar='list',
+                          default="create,set,get,delete",
+                          help='Comma separated workloads, run in order create,set,get,delete, default all')
+    zk_bench.add_argument('--json', dest='json', action='store_true',
+                          help='Print the results as json')
+    zk_leave = subparsers_zk.add_parser("leave", description='Remove this server from the ensemble configuration')
+    zk_leave.add_argument('--password', dest='password', action='store', metavar='str', required=True,
+                          help='Zookeeper super-user password')
+
+
+def _mesosParser(parser_mesos):
     subparsers_mesos = parser_mesos.add_subparsers(dest='action', help="Mesos service actions")
 
     mesos_start = subparsers_mesos.add_parser("start", description='Start a Mesos service')
@@ -156,7 +582,17 @@ def cli():
     mesos_start.add_argument('-zk', '--zookeeper', dest='zookeeper', action='store', metavar='str',
                              help='Zookeeper Address, default zk://${bind}:2181')
     mesos_start.add_argument('--resources', dest='resources', action='store', metavar='str',
-                             help='Mesos resource file, file:/// or string')
+                             help='Mesos resource file, file:/// or string, default auto: host cpus, memory and '
+                                  'disk minus the reserved resources and the co-located ignis services')
+    mesos_start.add_argument('--reserved-cpus', dest='reserved_cpus', action='store', metavar='float', type=float,
+                             help='Cpus reserved for the system when resources are auto, default 1')
+    mesos_start.add_argument('--reserved-mem', dest='reserved_mem', action='store', metavar='size',
+                             help='Memory reserved for the system when resources are auto, default 10%% of the host '
+                                  'memory with a minimum of 1g')
+    mesos_start.add_argument('--reserved-disk', dest='reserved_disk', action='store', metavar='size',
+                             help='Disk reserved for the system when resources are auto, default 5g')
+    mesos_start.add_argument('--attributes', dest='attributes', action='store', metavar='str',
+                             help='Agent attributes (e.g. rack:r1;zone:z1), numa_nodes and sockets are always added')
     mesos_start.add_argument('--port-master', dest='port_master', action='store', metavar='int', type=int,
                              help='Mesos master Port, default 5050')
     mesos_start.add_argument('--port-agent', dest='port_agent', action='store', metavar='int', type=int,
@@ -167,16 +603,34 @@ def cli():
                              help='Agent will not be launched ')
     mesos_start.add_argument('--data', dest='data', action='store', metavar='path',
                              help='Data directory, default /var/lib/ignis/mesos')
+    mesos_start.add_argument('--sandbox', dest='sandbox', action='store', metavar='path',
+                             help='Agent work directory holding the executor sandboxes, use a fast scratch disk, '
+                                  'default the data directory')
+    mesos_start.add_argument('--fetcher-cache-size', dest='fetcher_cache_size', action='store', metavar='size',
+                             help='Fetcher cache size (e.g. 10g), default 2g')
+    mesos_start.add_argument('--fetcher-cache-dir', dest='fetcher_cache_dir', action='store', metavar='path',
+                             help='Fetcher cache directory, default ${data}/fetch')
+    mesos_start.add_argument('--image-gc-headroom', dest='image_gc_headroom', action='store', metavar='float',
+                             type=float, help='Remove unused images of the Mesos containerizer store when its free '
+                                              'disk fraction falls below this value (e.g. 0.1), default disabled. '
+                                              'The images of the docker daemon used by the Docker containerizer are '
+                                              'not affected')
+    mesos_start.add_argument('--gc-disk-headroom', dest='gc_disk_headroom', action='store', metavar='float',
+                             type=float, help='Free disk fraction kept when removing old sandboxes, default 0.1')
+    mesos_start.add_argument('--preload', dest='preload', action='store', nargs='*', metavar='image',
+                             help='Pull the images into the docker daemon before the agent starts, so the Docker '
+                                  'containerizer does not pull them for the first executors. Without images all the '
+                                  'executor images of the registry')
     mesos_start.add_argument('--docker', dest='docker_bin', action='store', metavar='path',
                              help='Docker binary, default /usr/bin/docker')
-    common_arguments(mesos_start, force=True, clear=True, registry=True, namespace=True, tag=True)
+    common_arguments(mesos_start, force=True, clear=True, registry=True, namespace=True, tag=True, wait=True)
 
     mesos_stop = subparsers_mesos.add_parser("stop", description='Stop the Mesos service')
     mesos_resume = subparsers_mesos.add_parser("resume", description='Resume the Mesos service')
     mesos_destroy = subparsers_mesos.add_parser("destroy", description='Destroy the Mesos service')
 
-    # Submitter parser
-    parser_submitter = subparsers.add_parser(submitter.MODULE_NAME, description='Ignis applications submitter')
+
+def _submitterParser(parser_submitter):
     subparsers_submitter = parser_submitter.add_subparsers(dest='action', help="Ignis submitter service actions")
 
     submitter_start = subparsers_submitter.add_parser("start", description='Start a Ignis submitter service')
@@ -197,14 +651,14 @@ def cli():
     submitter_start.add_argument('--mount', dest='mounts', action='append', metavar=('host', 'container'), nargs="+"
                                  , help='Create environment variable inside submit. Use <host>:ro to read only',
                                  default=[])
-    common_arguments(submitter_start, force=True, clear=False, registry=True, namespace=True, tag=True)
+    common_arguments(submitter_start, force=True, clear=False, registry=True, namespace=True, tag=True, wait=True)
 
     submitter_stop = subparsers_submitter.add_parser("stop", description='Stop the Ignis submitter service')
     submitter_resume = subparsers_submitter.add_parser("resume", description='Resume the Ignis submitter service')
     submitter_destroy = subparsers_submitter.add_parser("destroy", description='Destroy the Ignis submitter service')
 
-    # Images
-    parser_submitter = subparsers.add_parser(images.MODULE_NAME, description='Ignis images manager')
+
+def _imagesParser(parser_submitter):
     subparsers_images = parser_submitter.add_subparsers(dest='action', help="Ignis images actions")
 
     images_clear = subparsers_images.add_parser("clear", description='Delete all Ignis images')
@@ -262,7 +716,20 @@ def cli():
     images_build.add_argument('--custom-image', dest='custom_images', action='append', metavar=('name', 'cores'),
                               nargs="+", help='Path core folders', default=[])
     images_build.add_argument('--platform', dest='platform', action='store',
-                              help='Create ignis images for one or more platforms, requires buildx.')
+                              help='Create ignis images for one or more platforms separated by commas, requires '
+                                   'buildx. Multiple platforms are built concurrently and assembled as a manifest '
+                                   'list in the registry')
+    images_build.add_argument('--platform-builder', dest='platform_builders', action='append',
+                              metavar=('platform', 'builder'), nargs=2,
+                              help='Use a buildx builder instance for a platform, default current builder', default=[])
+    images_build.add_argument('--legacy-builder', dest='legacy', action='store_true', default=False,
+                              help='Use the legacy docker builder instead of BuildKit when no platform is selected')
+    images_build.add_argument('--build-hosts', dest='build_hosts', metavar='host', nargs="+", default=[],
+                              help='Additional docker hosts (url or docker context) used to distribute the builds, '
+                                   'images are moved between hosts using the registry')
+    images_build.add_argument('--pull', dest='pull', action='store_true', default=False,
+                              help='Always pull newer versions of the external parent images, by default the local '
+                                   'cache is used. Parents built in the same run are always pulled on --build-hosts')
     common_arguments(images_build, registry=True, namespace=True)
 
     images_singularity = subparsers_images.add_parser("singularity",
@@ -275,187 +742,99 @@ def cli():
                               help='Create a singularity images using other platform, requires buildx.')
     common_arguments(images_singularity, registry=True, force=True)
 
-    args = parser.parse_args(['-h'] if len(sys.argv) == 1 else None)
-    if args.service == "version":
-        print(version.__version__)
-        exit(0)
-
-    if "action" in args and not args.action:
-        subparsers.choices[args.service].print_help()
-        sys.exit(0)
-
-    default_registry = registry.parse(args.registry if "registry" in args else None)
-    namespace = args.namespace if "namespace" in args else ""
-    img_tag = args.tag if "tag" in args else ""
-    if len(namespace) > 0 and namespace[-1] != "/":
-        namespace += "/"
-    if len(img_tag) > 0 and img_tag[0] != ':':
-        img_tag = ":" + img_tag
-    url_namespace = default_registry + namespace
-
-    if args.service == "status":
-        print("Service Status:")
-        print("    Registry  " + registry.status())
-        print(" Registry-ui  " + registry_ui.status())
-        print("       Nomad  " + nomad.status())
-        print("   Zookeeper  " + zookeeper.status())
-        print("       Mesos  " + mesos.status())
-        print("   Submitter  " + submitter.status())
-    elif args.service == registry.MODULE_NAME:
-        if args.action == "start":
-            registry.start(bind=args.bind,
-                           port=args.port,
-                           path=args.path,
-                           default=args.default,
-                           clear=args.clear,
-                           force=args.force)
-        elif args.action == "garbage":
-            registry.garbage()
-        elif args.action == "stop":
-            registry.stop()
-        elif args.action == "resume":
-            registry.resume()
-        elif args.action == "destroy":
-            registry.destroy()
-    elif args.service == registry_ui.MODULE_NAME:
-        if args.action == "start":
-            registry_ui.start(port=args.port,
-                              registry=default_registry,
-                              force=args.force)
-        elif args.action == "stop":
-            registry.stop()
-        elif args.action == "resume":
-            registry.resume()
-        elif args.action == "destroy":
-            registry.destroy()
-    elif args.service == nomad.MODULE_NAME:
-        if args.action == "start":
-            nomad.start(bind=args.bind,
-                        partner=args.partner,
-                        ports=args.ports,
-                        password=args.password,
-                        config_file=args.config,
-                        name=args.name,
-                        data=args.data,
-                        no_client=args.no_client,
-                        no_server=args.no_server,
-                        docker_bin=args.docker_bin,
-                        volumes=args.volumes,
-                        url_namespace=url_namespace,
-                        img_tag=img_tag,
-                        force=args.force,
-                        clear=args.clear)
-        elif args.action == "stop":
-            nomad.stop()
-        elif args.action == "resume":
-            nomad.resume()
-        elif args.action == "destroy":
-            nomad.destroy()
-    elif args.service == zookeeper.MODULE_NAME:
-        if args.action == "start":
-            zookeeper.start(bind=args.bind,
-                            id=args.id,
-                            partner=args.partner,
-                            password=args.password,
-                            ports=args.ports,
-                            logs=args.logs,
-                            conf=args.conf,
-                            data=args.data,
-                            url_namespace=url_namespace,
-                            img_tag=img_tag,
-                            clear=args.clear,
-                            force=args.force)
-        elif args.action == "stop":
-            zookeeper.stop()
-        elif args.action == "resume":
-            zookeeper.resume()
-        elif args.action == "destroy":
-            zookeeper.destroy()
-    elif args.service == mesos.MODULE_NAME:
-        if args.action == "start":
-            mesos.start(service=args.mesos_service,
-                        bind=args.bind,
-                        quorum=args.quorum,
-                        name=args.name,
-                        zookeeper=args.zookeeper,
-                        resources=args.resources,
-                        port_master=args.port_master,
-                        port_agent=args.port_agent,
-                        port_service=args.port_service,
-                        no_agent=args.no_agent,
-                        data=args.data,
-                        docker_bin=args.docker_bin,
-                        url_namespace=url_namespace,
-                        img_tag=img_tag,
-                        clear=args.clear,
-                        force=args.force,
-                        )
-        elif args.action == "stop":
-            mesos.stop()
-        elif args.action == "resume":
-            mesos.resume()
-        elif args.action == "destroy":
-            mesos.destroy()
-    elif args.service == submitter.MODULE_NAME:
-        if args.action == "start":
-            submitter.start(port=args.port,
-                            dfs=args.dfs,
-                            dfs_home=args.dfs_home,
-                            password=args.password,
-                            scheduler=args.scheduler[0],
-                            shceduler_url=args.scheduler[1],
-                            dns=args.dns,
-                            envs=args.envs,
-                            mounts=args.mounts,
-                            default_registry=default_registry,
-                            url_namespace=url_namespace,
-                            img_tag=img_tag,
-                            force=args.force)
-        elif args.action == "stop":
-            submitter.stop()
-        elif args.action == "resume":
-            submitter.resume()
-        elif args.action == "destroy":
-            submitter.destroy()
-    elif args.service == images.MODULE_NAME:
-        if args.action == "clear":
-            images.clear(yes=args.yes,
-                         version=args.version,
-                         whitelist=args.whitelist,
-                         blacklist=args.blacklist,
-                         add_none=args.add_none,
-                         force=args.force,
-                         default_registry=default_registry,
-                         namespace=namespace)
-        elif args.action == "push":
-            images.push(yes=args.yes,
-                        builders=args.builders,
-                        version=args.version,
-                        whitelist=args.whitelist,
-                        blacklist=args.blacklist,
-                        default_registry=default_registry,
-                        namespace=namespace)
-        elif args.action == "build":
-            images.build(sources=args.sources,
-                         local_sources=args.local_sources,
-                         ignore_folders=args.ignore_folders,
-                         version_filters=args.version_filters,
-                         custom_images=args.custom_images,
-                         bases=args.bases,
-                         full=args.full,
-                         save_logs=args.logs,
-                         version_tags=args.version_tags,
-                         version=args.version,
-                         default_registry=default_registry,
-                         namespace=namespace,
-                         platform=args.platform)
-        elif args.action == "singularity":
-            images.singularity(name=args.image,
-                               output=args.output,
-                               host=args.host,
-                               default_registry=default_registry,
-                               platform=args.platform,
-                               force=args.force)
+    images_analyze = subparsers_images.add_parser("analyze", description='Analyze layer sizes and duplicated files '
+                                                                         'of Ignis images')
+    images_analyze.add_argument('--version', dest='version', action='store', metavar='str',
+                                help='Analyze only a selected version')
+    images_analyze.add_argument('--compare', dest='compare', action='store', metavar='version',
+                                help='Compare image sizes against a previous version')
+    images_analyze.add_argument('--threshold', dest='threshold', action='store', metavar='percent', type=float,
+                                help='Size increase considered a regression, default 5', default=5.0)
+    images_analyze.add_argument('--top', dest='top', action='store', metavar='int', type=int,
+                                help='Number of duplicated files to show, default 20', default=20)
+    images_analyze.add_argument('--whitelist', dest='whitelist', metavar='image',
+                                nargs="+", help='Only analyzes images in the white list', default=None)
+    images_analyze.add_argument('--blacklist', dest='blacklist', metavar='image',
+                                nargs="+", help='Ignore images(including whitelist) in the black list', default=[])
+    common_arguments(images_analyze, registry=True, namespace=True)
+
+    images_save = subparsers_images.add_parser("save", description='Save Ignis images in a layer-deduplicated bundle')
+    images_save.add_argument('output', action='store', help='Bundle file output.')
+    images_save.add_argument('--builders', dest='builders', action='store_true', default=False,
+                             help='Save builders in the bundle, default false')
+    images_save.add_argument('--version', dest='version', action='store', metavar='str',
+                             help='Save only a selected version')
+    images_save.add_argument('--whitelist', dest='whitelist', metavar='image',
+                             nargs="+", help='Only saves images in the white list', default=None)
+    images_save.add_argument('--blacklist', dest='blacklist', metavar='image',
+                             nargs="+", help='Ignore images(including whitelist) in the black list', default=[])
+    images_save.add_argument('--level', dest='level', action='store', metavar='[0-9]', type=int,
+                             choices=range(0, 10), help='Layer compression level, default 6', default=6)
+    images_save.add_argument('-j', '--jobs', dest='jobs', action='store', metavar='int', type=int,
+                             help='Images exported in parallel, default cpu count', default=None)
+    common_arguments(images_save, registry=True, namespace=True, force=True)
+
+    images_sync = subparsers_images.add_parser("sync", description='Copy Ignis images between two registries')
+    images_sync.add_argument('source', action='store', help='Source registry url.')
+    images_sync.add_argument('destination', action='store', help='Destination registry url.')
+    images_sync.add_argument('--version', dest='version', action='store', metavar='str',
+                             help='Copy only a selected version')
+    images_sync.add_argument('-j', '--jobs', dest='jobs', action='store', metavar='int', type=int,
+                             help='Blobs transferred in parallel, default 8', default=8)
+    common_arguments(images_sync, namespace=True)
+
+    images_distribute = subparsers_images.add_parser("distribute", description='Pull Ignis images on every node')
+    images_distribute.add_argument('images', nargs='+', metavar='image', help='Images to pull.')
+    images_distribute.add_argument('--nodes', dest='nodes', nargs='+', metavar='node', default=[],
+                                   help='Node hostnames or docker urls')
+    images_distribute.add_argument('--nomad', dest='nomad', action='store', metavar='url',
+                                   help='Add the ready clients of a Nomad cluster, e.g. localhost:4646')
+    images_distribute.add_argument('--mesos', dest='mesos', action='store', metavar='url',
+                                   help='Add the active agents of a Mesos master, e.g. localhost:5050')
+    images_distribute.add_argument('--endpoint', dest='endpoint', action='store', metavar='format',
+                                   help='Docker url used for each node hostname, default tcp://{}:2375',
+                                   default="tcp://{}:2375")
+    images_distribute.add_argument('-j', '--jobs', dest='jobs', action='store', metavar='int', type=int,
+                                   help='Nodes pulling at the same time, default 16', default=16)
+    common_arguments(images_distribute, registry=True)
+
+    images_load = subparsers_images.add_parser("load", description='Load Ignis images from a bundle')
+    images_load.add_argument('bundle', action='store', help='Bundle file created by save.')
+    images_load.add_argument('-j', '--jobs', dest='jobs', action='store', metavar='int', type=int,
+                             help='Images loaded in parallel, default cpu count', default=None)
+
+
+def common_arguments(parser, force=False, clear=False, registry=False, namespace=False, tag=False, wait=False):
+    if force:
+        parser.add_argument('-f', '--force', dest='force', action='store_true',
+                            help='Destroy container if exists')
+    if clear:
+        parser.add_argument('-c', '--clear', dest='clear', action='store_true',
+                            help='Clear all previous data')
+    if registry:
+        parser.add_argument('--docker-registry', dest='registry', action='store', metavar='url',
+                            help='Docker image registry', default=None)
+    if namespace:
+        parser.add_argument('--docker-namespace', dest='namespace', action='store', metavar='name',
+                            help='Docker image namespace', default="ignishpc")
+    if tag:
+        parser.add_argument('--docker-tag', dest='tag', action='store', metavar='tag',
+                            help='Docker image tag', default="")
+    if wait:
+        parser.add_argument('--wait', dest='wait', action='store', metavar='seconds', type=float, nargs='?',
+                            const=300, default=None,
+                            help='Wait until the service is ready, fail after seconds, default 300')
+
+
+SERVICES = [
+    ('registry', 'Image registry', _registryParser),
+    ('registry-ui', 'Image registry-ui', _registryUiParser),
+    ('nomad', 'Nomad cluster', _nomadParser),
+    ('zookeeper', 'Zookeeper cluster', _zookeeperParser),
+    ('mesos', 'Mesos cluster', _mesosParser),
+    ('submitter', 'Ignis applications submitter', _submitterParser),
+    ('images', 'Ignis images manager', _imagesParser),
+]
 
 
 def main():
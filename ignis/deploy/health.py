@@ -0,0 +1,239 @@
+import json
+import socket
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import ignis.deploy.registry_api as registry_api
+
+TIMEOUT = 5
+BACKOFF_INITIAL = 0.25
+BACKOFF_MAX = 5
+
+
+def check(services, timeout=TIMEOUT):
+    result = list()
+    tasks = list()
+    with ThreadPoolExecutor(max_workers=max(1, sum(len(probes) for _, _, probes in services))) as pool:
+        for name, status, probes in services:
+            service = {
+                "service": name,
+                "status": status,
+                "healthy": None if status == "NOT_FOUND" else status == "RUNNING",
+                "probes": list()
+            }
+            result.append(service)
+            for probe_name, probe in probes:
+                tasks.append((service, pool.submit(_run, probe_name, probe, timeout)))
+        for service, task in tasks:
+            probe = task.result()
+            service["probes"].append(probe)
+            service["healthy"] = service["healthy"] and probe["healthy"]
+    return result
+
+
+def _run(name, probe, timeout):
+    start = time.perf_counter()
+    try:
+        detail = probe(timeout)
+        healthy = True
+    except Exception as ex:
+        detail = str(ex) or type(ex).__name__
+        healthy = False
+    return {
+        "probe": name,
+        "healthy": healthy,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "detail": detail
+    }
+
+
+def backoff(timeout, initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX):
+    deadline = time.time() + timeout
+    delay = initial
+    while True:
+        yield
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, maximum)
+
+
+def wait(name, container, probes, timeout):
+    error = None
+    for _ in backoff(timeout):
+        container.reload()
+        if container.status != "running":
+            raise RuntimeError(name + " is " + container.status + ", check 'docker logs " + container.name + "'")
+        try:
+            for _, probe in probes:
+                probe(TIMEOUT)
+            return
+        except Exception as ex:
+            error = ex
+    raise RuntimeError(name + " not ready after " + "{:g}".format(timeout) + "s: " + str(error))
+
+
+def fourLetter(host, port, command, timeout):
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(command.encode("utf-8"))
+        data = b""
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    return data.decode("utf-8")
+
+
+def zookeeperPort(host, port, timeout):
+    answer = fourLetter(host, port, "ruok", timeout)
+    if answer != "imok":
+        raise RuntimeError("ruok answered '" + answer.strip() + "'")
+    return answer
+
+
+def mntr(host, port, timeout):
+    result = dict()
+    answer = fourLetter(host, port, "mntr", timeout)
+    for line in answer.splitlines():
+        if "\t" in line:
+            key, value = line.split("\t", 1)
+            result[key] = value
+    if "zk_server_state" not in result:
+        raise RuntimeError(answer.strip() or "mntr without answer")
+    return result
+
+
+def zookeeper(host, port, timeout):
+    zookeeperPort(host, port, timeout)
+    metrics = mntr(host, port, timeout)
+    state = metrics["zk_server_state"]
+    if state not in ("leader", "follower", "observer"):
+        raise RuntimeError("no quorum, server is " + state)
+    detail = state
+    if state == "leader" and "zk_synced_followers" in metrics:
+        detail += ", " + metrics["zk_synced_followers"] + " synced followers"
+    return detail + ", avg latency " + metrics.get("zk_avg_latency", "?") + "ms"
+
+
+def http(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as rsp:
+        return rsp.status, rsp.read()
+
+
+def nomad(url, timeout):
+    _, body = http(url + "/v1/status/leader", timeout)
+    leader = json.loads(body)
+    if not leader:
+        raise RuntimeError("no leader")
+    return "leader " + leader
+
+
+def mesosMaster(url, timeout):
+    http(url + "/health", timeout)
+    _, body = http(url + "/metrics/snapshot", timeout)
+    metrics = json.loads(body)
+    if metrics.get("master/elected"):
+        return "elected leader, " + str(int(metrics.get("master/slaves_active", 0))) + " active agents"
+    return "standby"
+
+
+def mesosAgent(url, timeout):
+    http(url + "/health", timeout)
+    _, body = http(url + "/metrics/snapshot", timeout)
+    if not json.loads(body).get("slave/registered"):
+        raise RuntimeError("not registered with a master")
+    return "registered"
+
+
+def registry(url, timeout):
+    try:
+        with registry_api.request(url, "/v2/", timeout=timeout) as rsp:
+            version = rsp.headers.get("Docker-Distribution-API-Version")
+    except urllib.error.HTTPError as ex:
+        if ex.code != 401:
+            raise
+        version = ex.headers.get("Docker-Distribution-API-Version")
+    return version or "ok"
+
+
+def ssh(host, port, timeout):
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        banner = sock.recv(256).decode("utf-8", errors="replace").strip()
+    if not banner.startswith("SSH-"):
+        raise RuntimeError("unexpected banner '" + banner + "'")
+    return banner
+
+
+_TRANSITIONS = {
+    "create": "CREATED",
+    "start": "RUNNING",
+    "restart": "RUNNING",
+    "unpause": "RUNNING",
+    "pause": "PAUSED",
+    "die": "EXITED",
+    "destroy": "NOT_FOUND",
+}
+
+
+def watch(client, containers, output_json=False):
+    state = {name: {"status": container.status.upper(), "health": _containerHealth(container)}
+             for name, container in containers.items()}
+    events = client.events(decode=True, filters={"type": "container"})
+    try:
+        for event in events:
+            action = event.get("Action", event.get("status", ""))
+            attributes = event.get("Actor", {}).get("Attributes", {})
+            name = attributes.get("name", "")
+            if not name.startswith("ignis-"):
+                continue
+            last = state.setdefault(name, {"status": "NOT_FOUND", "health": None})
+            change = {
+                "time": event.get("time"),
+                "container": name,
+                "event": action.split(":")[0],
+            }
+            if action.startswith("health_status"):
+                current = action.split(":", 1)[1].strip()
+                if current == last["health"]:
+                    continue
+                change["from"], change["to"] = last["health"], current
+                last["health"] = current
+            elif action == "oom":
+                change["from"] = change["to"] = last["status"]
+            elif action in _TRANSITIONS:
+                current = _TRANSITIONS[action]
+                if current == last["status"] and action not in ("restart", "die"):
+                    continue
+                change["from"], change["to"] = last["status"], current
+                last["status"] = current
+                if action == "die":
+                    change["exit_code"] = int(attributes.get("exitCode", -1))
+            else:
+                continue
+            _emit(change, output_json)
+    finally:
+        events.close()
+
+
+def _containerHealth(container):
+    health = container.attrs.get("State", {}).get("Health")
+    return health["Status"] if health else None
+
+
+def _emit(change, output_json):
+    if output_json:
+        print(json.dumps(change), flush=True)
+        return
+    line = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(change["time"])) + "  " + \
+           change["container"].ljust(24) + change["event"].ljust(16)
+    if change["from"] != change["to"]:
+        line += str(change["from"]) + " -> " + str(change["to"])
+    else:
+        line += str(change["to"])
+    if "exit_code" in change:
+        line += " (exit code " + str(change["exit_code"]) + ")"
+    print(line, flush=True)
@@ -1,20 +1,22 @@
 import datetime
+import functools
+import gzip
+import hashlib
+import io
+import json
 import os
 import re
 import shutil
+import tarfile
 import tempfile
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from distutils.version import StrictVersion
 
 import docker
 import docker.errors
 
-try:
-    import git
-
-    GIT_ERROR = None
-except Exception as ex:
-    GIT_ERROR = ex
+import ignis.deploy.registry_api as registry_api
+import ignis.deploy.utils as utils
 
 MODULE_NAME = "images"
 
@@ -73,7 +75,22 @@ def push(yes, builders, version, whitelist, blacklist, default_registry, namespa
 
 
 def build(sources, local_sources, ignore_folders, version_filters, custom_images, bases, full, save_logs, version_tags,
-          version, default_registry, namespace, platform):
+          version, default_registry, namespace, platform, platform_builders, legacy, build_hosts, pull):
+    platforms = platform.split(",") if platform else None
+    if platforms and len(platforms) > 1 and not default_registry:
+        raise RuntimeError("multi-platform builds are assembled in a registry, use --docker-registry to select one")
+    builders = dict()
+    for pb in platform_builders:
+        builders[pb[0]] = pb[1]
+    hosts = None
+    if build_hosts:
+        if not default_registry:
+            raise RuntimeError("images are moved between build hosts using a registry, use --docker-registry to "
+                               "select one")
+        hosts = _BuildHosts([None] + [__buildHost(host) for host in build_hosts])
+    if platforms or not legacy:
+        __checkBuildx()
+
     with tempfile.TemporaryDirectory(prefix="ignis") as wd:
         core_list = list()
         version_map = dict()
@@ -105,8 +122,9 @@ def build(sources, local_sources, ignore_folders, version_filters, custom_images
 
         print("Sources:")
         sid = 0
-        if len(sources) > 0 and GIT_ERROR is not None:
-            raise GIT_ERROR
+        if len(sources) > 0:
+            # GitPython is slow to import, it is only loaded when a source must be cloned
+            import git
         for src in sources:
             name = src.split("/")[-1]
             if name.endswith(".git"):
@@ -266,15 +284,29 @@ def build(sources, local_sources, ignore_folders, version_filters, custom_images
                     version=build["version"],
                     default_registry=default_registry,
                     namespace=namespace,
-                    platform=platform
+                    platforms=platforms,
+                    builders=builders,
+                    legacy=legacy,
+                    hosts=hosts,
+                    pull=pull
                 )))
         print("Build end")
+        if hosts:
+            print("Pulling images from build hosts:")
+            client = docker.from_env()
+            for i, (info, img) in enumerate(image_list):
+                if img is not None:
+                    image_list[i] = (info, client.images.pull(info['name'], tag=info['version']))
+                    print("  ", info['name'] + ':' + info['version'])
         if version_tags:
             print("Setting additional version tag:")
             for vt in version_tags:
                 for info, img in image_list:
                     tag = info['name'] + ':' + vt
-                    img.tag(tag)
+                    if img is None:
+                        __imagetools(tag, [info['name'] + ':' + info['version']])
+                    else:
+                        img.tag(tag)
                     print("  ", tag)
 
 
@@ -333,6 +365,246 @@ def singularity(name, output, host, default_registry, platform, force):
         raise RuntimeError("singularity fails with error " + str(exit_code) + "\n" + err)
 
 
+def analyze(version, compare, whitelist, blacklist, top, threshold, default_registry, namespace):
+    client = docker.from_env()
+    images = __getImages(client, version, default_registry, namespace, whitelist, blacklist)
+    images.sort(key=lambda x: x[1])
+    if len(images) == 0:
+        print("No images found")
+        return
+
+    layers = dict()
+    contents = dict()
+    for img_id, img_tag, _ in images:
+        img_layers = __analyzeImage(client, img_tag, layers, contents)
+        total = sum(map(lambda layer: layer["size"], img_layers))
+        print(img_tag, "(" + utils.sizeFormat(total) + ")")
+        print("  SIZE        SHARED  INSTRUCTION")
+        instructions = dict()
+        for layer in img_layers:
+            shared = "yes" if len(layers[layer["diff_id"]]["images"]) > 1 else "no"
+            print("  " + utils.sizeFormat(layer["size"]).ljust(10), shared.rjust(6), "", layer["instruction"][:100])
+            keyword = layer["instruction"].split(" ")[0]
+            instructions[keyword] = instructions.get(keyword, 0) + layer["size"]
+        print("  SIZE        INSTRUCTION TOTAL")
+        for keyword, size in sorted(instructions.items(), key=lambda x: x[1], reverse=True):
+            print("  " + utils.sizeFormat(size).ljust(10), "", keyword)
+
+        if compare:
+            name = img_tag[:img_tag.rindex(":")]
+            try:
+                previous = client.images.get(name + ":" + compare)
+            except docker.errors.ImageNotFound:
+                print("  warn: " + name + ":" + compare + " not found, comparison skipped")
+                previous = None
+            if previous is not None:
+                prev_size = previous.attrs["Size"]
+                size = client.images.get(img_tag).attrs["Size"]
+                diff = (size - prev_size) * 100.0 / prev_size if prev_size > 0 else 0
+                print("  " + compare + ": " + utils.sizeFormat(prev_size) + " -> " + utils.sizeFormat(size),
+                      "({:+.1f}%)".format(diff), "REGRESSION" if diff > threshold else "")
+        print()
+
+    duplicates = list()
+    for digest, files in contents.items():
+        owners = set(map(lambda file: file[0], files))
+        if len(owners) > 1:
+            size = files[0][2]
+            duplicates.append((size * (len(owners) - 1), size, files))
+    duplicates.sort(key=lambda x: x[0], reverse=True)
+
+    print("Duplicated files in different layers:")
+    wasted = sum(map(lambda x: x[0], duplicates))
+    print("  " + str(len(duplicates)) + " files, " + utils.sizeFormat(wasted) + " wasted")
+    print("  WASTED      SIZE        COPIES  FILE")
+    for wasted, size, files in duplicates[:top]:
+        paths = sorted(set(map(lambda file: file[1], files)))
+        owners = set(map(lambda file: file[0], files))
+        print("  " + utils.sizeFormat(wasted).ljust(10), "", utils.sizeFormat(size).ljust(10),
+              str(len(owners)).rjust(6), "",
+              paths[0] + (" (+" + str(len(paths) - 1) + " paths)" if len(paths) > 1 else ""))
+        imgs = set()
+        for owner in owners:
+            imgs.update(layers[owner]["images"])
+        print("  " + " " * 32 + ", ".join(sorted(imgs)))
+
+
+def save(output, builders, version, whitelist, blacklist, level, jobs, force, default_registry, namespace):
+    if os.path.exists(output) and not force:
+        raise RuntimeError(output + " already exists, use --force to overwrite")
+    client = docker.from_env()
+    images = __getImages(client, version, default_registry, namespace, whitelist, blacklist)
+    images.sort(key=lambda x: x[1])
+    if not builders:
+        builder = re.compile(".*\/.*-?builder(:.+)?")
+        images = list(filter(lambda img: not builder.match(img[1]), images))
+    if len(images) == 0:
+        print("No images found")
+        return
+
+    with tempfile.TemporaryDirectory(prefix="ignis") as wd:
+        os.makedirs(os.path.join(wd, "blobs", "sha256"))
+        os.makedirs(os.path.join(wd, "layers", "sha256"))
+        claimed = set()
+        lock = threading.Lock()
+        index = {"images": list()}
+        print("Images:")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            wait_list = list()
+            for _, img_tag, _ in images:
+                wait_list.append((img_tag, executor.submit(__bundleImage, client, img_tag, wd, claimed, lock, level)))
+            for img_tag, wait in wait_list:
+                index["images"].append(wait.result())
+                print("  " + img_tag, "SAVED")
+
+        with open(os.path.join(wd, "index.json"), "w") as file:
+            json.dump(index, file, indent=4)
+        with tarfile.open(output, "w") as bundle:
+            bundle.add(os.path.join(wd, "index.json"), arcname="index.json")
+            bundle.add(os.path.join(wd, "blobs"), arcname="blobs")
+            bundle.add(os.path.join(wd, "layers"), arcname="layers")
+    print(str(len(images)) + " images and " + str(len(claimed)) + " layers saved in " + output +
+          " (" + utils.sizeFormat(os.path.getsize(output)) + ")")
+
+
+def load(bundle, jobs):
+    client = docker.from_env()
+    with tarfile.open(bundle, "r:") as tar:
+        index = json.load(tar.extractfile("index.json"))
+
+    present = set()
+    for img in client.images.list(all=True):
+        layers = img.attrs.get("RootFS", {}).get("Layers", [])
+        for i in range(len(layers)):
+            present.add(tuple(layers[:i + 1]))
+
+    owners = dict()
+    print("Images:")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        wait_list = list()
+        for info in index["images"]:
+            layers = list()
+            deps = set()
+            for i, diff_id in enumerate(info["layers"]):
+                chain = tuple(info["layers"][:i + 1])
+                if chain in present:
+                    continue
+                if chain in owners:
+                    deps.add(owners[chain])
+                else:
+                    layers.append(diff_id)
+            future = executor.submit(__loadBundleImage, client, bundle, info, layers, deps)
+            for i, diff_id in enumerate(info["layers"]):
+                owners.setdefault(tuple(info["layers"][:i + 1]), future)
+            wait_list.append((info["tag"], layers, future))
+
+        error = None
+        for img_tag, layers, wait in wait_list:
+            try:
+                wait.result()
+                print("  " + img_tag, "LOADED", "(" + str(len(layers)) + " new layers)")
+            except Exception as ex:
+                print("  " + img_tag, "FAILED", str(ex))
+                error = ex
+        if error:
+            raise error
+
+
+def sync(source, destination, version, jobs, namespace):
+    source = registry_api.parseUrl(source)
+    destination = registry_api.parseUrl(destination)
+    repos = list(filter(lambda repo: repo.startswith(namespace), registry_api.catalog(source)))
+    images = list()
+    for repo in repos:
+        for tag in registry_api.tags(source, repo):
+            if version is None or tag == version:
+                images.append((repo, tag))
+    images.sort()
+    if len(images) == 0:
+        print("No images found")
+        return
+
+    print("Manifests:")
+    manifests = dict()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        wait_list = [((repo, tag), executor.submit(__syncManifests, source, repo, tag)) for repo, tag in images]
+        for (repo, tag), wait in wait_list:
+            manifests[(repo, tag)] = wait.result()
+            print("  " + repo + ":" + tag)
+
+    uploads = dict()
+    mounts = set()
+    for (repo, tag), image_manifests in manifests.items():
+        for _, _, _, blobs in image_manifests:
+            for digest, _ in blobs:
+                if digest not in uploads:
+                    uploads[digest] = repo
+                elif uploads[digest] != repo:
+                    mounts.add((repo, digest))
+
+    print("Blobs:")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        transferred = sum(executor.map(lambda task: __syncBlob(source, destination, task[1], task[0], None),
+                                       uploads.items()))
+        transferred += sum(executor.map(lambda task: __syncBlob(source, destination, task[0], task[1],
+                                                                uploads[task[1]]), mounts))
+    print("  " + str(len(uploads)) + " blobs, " + utils.sizeFormat(transferred) + " transferred")
+
+    print("Images:")
+    for (repo, tag), image_manifests in manifests.items():
+        for reference, media_type, raw, _ in image_manifests:
+            registry_api.putManifest(destination, repo, reference, media_type, raw)
+        print("  " + repo + ":" + tag, "SYNCED")
+
+
+def distribute(names, nodes, endpoint, jobs, default_registry):
+    images = list()
+    for name in names:
+        img = default_registry + name
+        if ':' not in name:
+            img += ":latest"
+        images.append(img)
+    endpoints = [node if "://" in node else endpoint.format(node) for node in nodes]
+    if len(endpoints) == 0:
+        raise RuntimeError("no nodes selected, use --nodes, --nomad or --mesos")
+
+    print("Pulling " + str(len(images)) + " images on " + str(len(endpoints)) + " nodes:")
+    lock = threading.Lock()
+
+    def pull(node):
+        client = __dockerClient(node, timeout=600)
+        errors = 0
+        for img in images:
+            t0 = datetime.datetime.now()
+            repo, tag = img.rsplit(':', 1)
+            try:
+                for line in client.api.pull(repo, tag=tag, stream=True, decode=True):
+                    if 'errorDetail' in line:
+                        raise docker.errors.APIError(line['errorDetail']['message'])
+                state = "PULLED ({:.1f}s)".format((datetime.datetime.now() - t0).total_seconds())
+            except Exception as ex:
+                errors += 1
+                state = "FAILED " + str(ex)
+            with lock:
+                print("  " + node + "  " + img + "  " + state, flush=True)
+        client.close()
+        return errors
+
+    failed = list()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        wait_list = [(node, executor.submit(pull, node)) for node in endpoints]
+        for node, wait in wait_list:
+            try:
+                if wait.result() > 0:
+                    failed.append(node)
+            except Exception as ex:
+                print("  " + node + "  FAILED " + str(ex), flush=True)
+                failed.append(node)
+    print(str(len(endpoints) - len(failed)) + "/" + str(len(endpoints)) + " nodes ready")
+    if failed:
+        raise RuntimeError("pull failed on " + ", ".join(failed))
+
+
 def __getImages(client, version, default_registry, namespace, whitelist, blacklist, none=False):
     labels = ["ignis"] if version is None else ["ignis=" + version]
     prefix = default_registry + namespace
@@ -418,8 +690,145 @@ def __dateFormat(elapsed):
             return result
 
 
+def __layerInstruction(created_by):
+    created_by = created_by.strip()
+    nop = "/bin/sh -c #(nop) "
+    if created_by.startswith("|"):
+        created_by = created_by.split(" ", int(created_by[1:].split(" ")[0]) + 1)[-1]
+    if created_by.startswith(nop):
+        return created_by[len(nop):].strip()
+    if created_by.startswith("/bin/sh -c "):
+        return "RUN " + created_by[len("/bin/sh -c "):].strip()
+    return created_by
+
+
+def __analyzeImage(client, tag, layers, contents):
+    result = list()
+    with tempfile.TemporaryFile() as archive:
+        for chunk in client.images.get(tag).save(named=False):
+            archive.write(chunk)
+        archive.seek(0)
+        with tarfile.open(fileobj=archive, mode="r:") as tar:
+            manifest = json.load(tar.extractfile("manifest.json"))[0]
+            config = json.load(tar.extractfile(manifest["Config"]))
+            history = list(filter(lambda h: not h.get("empty_layer", False), config.get("history", [])))
+            diff_ids = config["rootfs"]["diff_ids"]
+            for i, diff_id in enumerate(diff_ids):
+                instruction = __layerInstruction(history[i].get("created_by", "")) if i < len(history) else "?"
+                if diff_id in layers:
+                    layers[diff_id]["images"].add(tag)
+                    result.append({"diff_id": diff_id, "size": layers[diff_id]["size"], "instruction": instruction})
+                    continue
+                size = 0
+                with tarfile.open(fileobj=tar.extractfile(manifest["Layers"][i]), mode="r:*") as layer:
+                    for member in layer:
+                        if not member.isfile() or member.size == 0:
+                            continue
+                        size += member.size
+                        sha = hashlib.sha256()
+                        file = layer.extractfile(member)
+                        for block in iter(lambda: file.read(1024 * 1024), b""):
+                            sha.update(block)
+                        digest = sha.hexdigest()
+                        if digest not in contents:
+                            contents[digest] = list()
+                        contents[digest].append((diff_id, os.path.normpath("/" + member.name), member.size))
+                layers[diff_id] = {"images": {tag}, "size": size}
+                result.append({"diff_id": diff_id, "size": size, "instruction": instruction})
+    return result
+
+
+def __bundleImage(client, tag, wd, claimed, lock, level):
+    img = client.images.get(tag)
+    with tempfile.TemporaryFile() as archive:
+        for chunk in img.save(named=False):
+            archive.write(chunk)
+        archive.seek(0)
+        with tarfile.open(fileobj=archive, mode="r:") as tar:
+            manifest = json.load(tar.extractfile("manifest.json"))[0]
+            raw_config = tar.extractfile(manifest["Config"]).read()
+            config_digest = hashlib.sha256(raw_config).hexdigest()
+            with open(os.path.join(wd, "blobs", "sha256", config_digest), "wb") as file:
+                file.write(raw_config)
+            diff_ids = json.loads(raw_config)["rootfs"]["diff_ids"]
+            for i, diff_id in enumerate(diff_ids):
+                with lock:
+                    if diff_id in claimed:
+                        continue
+                    claimed.add(diff_id)
+                layer = os.path.join(wd, "layers", "sha256", diff_id.split(":")[-1] + ".tar.gz")
+                with tar.extractfile(manifest["Layers"][i]) as src, gzip.open(layer, "wb", level) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+    return {
+        "tag": tag,
+        "config": "sha256:" + config_digest,
+        "layers": diff_ids,
+    }
+
+
+def __loadBundleImage(client, bundle, info, layers, deps):
+    for dep in deps:
+        dep.result()
+    config = info["config"].split(":")[-1]
+    manifest = [{
+        "Config": config + ".json",
+        "RepoTags": [info["tag"]],
+        "Layers": [diff_id.split(":")[-1] + "/layer.tar" for diff_id in info["layers"]],
+    }]
+    with tempfile.TemporaryFile() as archive:
+        with tarfile.open(bundle, "r:") as src, tarfile.open(fileobj=archive, mode="w") as dst:
+            def add(name, fileobj, size):
+                entry = tarfile.TarInfo(name)
+                entry.size = size
+                dst.addfile(entry, fileobj)
+
+            raw_manifest = json.dumps(manifest).encode("utf-8")
+            add("manifest.json", io.BytesIO(raw_manifest), len(raw_manifest))
+            raw_config = src.extractfile("blobs/sha256/" + config).read()
+            add(config + ".json", io.BytesIO(raw_config), len(raw_config))
+            for diff_id in layers:
+                digest = diff_id.split(":")[-1]
+                with tempfile.TemporaryFile() as layer:
+                    sha = hashlib.sha256()
+                    with gzip.open(src.extractfile("layers/sha256/" + digest + ".tar.gz")) as gz:
+                        for block in iter(lambda: gz.read(1024 * 1024), b""):
+                            sha.update(block)
+                            layer.write(block)
+                    if sha.hexdigest() != digest:
+                        raise RuntimeError("layer " + diff_id + " is corrupted in " + bundle)
+                    size = layer.tell()
+                    layer.seek(0)
+                    add(digest + "/layer.tar", layer, size)
+        archive.seek(0)
+        client.images.load(archive)
+
+
+def __syncManifests(source, repo, tag):
+    media_type, raw, digest = registry_api.getManifest(source, repo, tag)
+    result = list()
+    if media_type in registry_api.LIST_TYPES:
+        for child, _ in registry_api.manifestChildren(raw):
+            child_type, child_raw, _ = registry_api.getManifest(source, repo, child)
+            result.append((child, child_type, child_raw, registry_api.manifestBlobs(child_raw)))
+    result.append((tag, media_type, raw, registry_api.manifestBlobs(raw)))
+    return result
+
+
+def __syncBlob(source, destination, repo, digest, mount_from):
+    if registry_api.hasBlob(destination, repo, digest):
+        return 0
+    if mount_from and registry_api.mountBlob(destination, repo, digest, mount_from):
+        return 0
+    with registry_api.getBlob(source, repo, digest) as blob:
+        size = int(blob.headers["Content-Length"])
+        registry_api.uploadBlob(destination, repo, digest, blob, size)
+    return size
+
+
 def __is_git(path):
-    if GIT_ERROR is not None:
+    try:
+        import git
+    except Exception:
         return False
     try:
         _ = git.Repo(path).git_dir
@@ -441,6 +850,8 @@ def __setVersion(name, path, version):
         return "latest"
     if not __is_git(path):
         return version
+    import git
+    from distutils.version import StrictVersion
     repo = git.Repo(path)
     tags = sorted(repo.tags, key=StrictVersion)
     found = False
@@ -454,14 +865,36 @@ def __setVersion(name, path, version):
     return tag
 
 
-def __docker_build(name, path, dockerfile, log, version, default_registry, namespace, platform):
+def __docker_build(name, path, dockerfile, log, version, default_registry, namespace, platforms, builders, legacy,
+                   hosts, pull):
     error = None
+    host = hosts.acquire() if hosts else None
+    buildargs = {
+        "REGISTRY": default_registry,
+        "NAMESPACE": namespace,
+        "TAG": ":" + version,
+        "RELPATH": os.path.relpath(os.path.dirname(dockerfile), path) + "/"
+    }
     try:
-        if platform is None:
-            client = docker.from_env()
-            build2 = client.images.build
+        if hosts and (platforms is None or len(platforms) == 1):
+            # A host may keep an older image with the same tag, the parents built in this run come from the registry
+            client = __dockerClient(host)
+            for parent in sorted(__parentImages(dockerfile, buildargs) & hosts.built()):
+                repo, tag = parent.rsplit(":", 1)
+                client.images.pull(repo, tag=tag)
+        if platforms is None and legacy:
+            client = __dockerClient(host)
+            build2 = functools.partial(client.images.build, pull=pull)
+            platform = None
+        elif platforms is None:
+            build2 = functools.partial(__buildx, host=host, pull=pull)
+            platform = None
+        elif len(platforms) == 1:
+            build2 = functools.partial(__buildx, builder=builders.get(platforms[0]), host=host, pull=pull)
+            platform = platforms[0]
         else:
-            build2 = __buildx
+            build2 = functools.partial(__buildxMulti, builders=builders, host=host, pull=pull)
+            platform = platforms
         imageObj, buildlog = build2(
             path=path,
             dockerfile=dockerfile,
@@ -469,14 +902,15 @@ def __docker_build(name, path, dockerfile, log, version, default_registry, names
                 "ignis": version
             },
             tag=name + ":" + version,
-            buildargs={
-                "REGISTRY": default_registry,
-                "NAMESPACE": namespace,
-                "TAG": ":" + version,
-                "RELPATH": os.path.relpath(os.path.dirname(dockerfile), path) + "/"
-            },
+            buildargs=buildargs,
             platform=platform
         )
+        if hosts and imageObj is not None:
+            for line in __dockerClient(host).images.push(name, tag=version, stream=True, decode=True):
+                if 'errorDetail' in line:
+                    raise docker.errors.APIError(line['errorDetail']['message'])
+        if hosts:
+            hosts.add(name + ":" + version)
     except docker.errors.BuildError as ex:
         imageObj = None
         buildlog = ex.build_log
@@ -494,6 +928,9 @@ def __docker_build(name, path, dockerfile, log, version, default_registry, names
         imageObj = None
         buildlog = []
         error = ex
+    finally:
+        if hosts:
+            hosts.release(host)
 
     # Remove ANSI color codes from the string.
     strip = re.compile('\033\\[([0-9]+)(;[0-9]+)*m')
@@ -554,9 +991,69 @@ def __createDockerfile(wd, id, cores, version, default_registry, namespace, orde
     }
 
 
-def __buildx(path, dockerfile, labels, tag, buildargs, platform):
+def __buildxMulti(path, dockerfile, labels, tag, buildargs, platform, builders, host=None, pull=False):
+    with ThreadPoolExecutor(max_workers=len(platform)) as executor:
+        wait_list = list()
+        for p in platform:
+            wait_list.append((p, executor.submit(
+                __buildx,
+                path=path,
+                dockerfile=dockerfile,
+                labels=labels,
+                tag=tag + "-" + p.replace("/", "-"),
+                buildargs=buildargs,
+                platform=p,
+                push=True,
+                builder=builders.get(p),
+                host=host,
+                pull=pull
+            )))
+        buildlog = list()
+        error = None
+        for p, wait in wait_list:
+            try:
+                _, platform_log = wait.result()
+            except docker.errors.BuildError as ex:
+                platform_log = list(ex.build_log)
+                if error is None:
+                    error = docker.errors.BuildError(p + ": " + str(ex.msg), buildlog)
+            buildlog.append({'stream': "#### " + p + " ####\n"})
+            buildlog.extend(platform_log)
+        if error:
+            raise error
+
+    __imagetools(tag, [tag + "-" + p.replace("/", "-") for p in platform])
+    return None, buildlog
+
+
+def __imagetools(tag, sources):
+    import subprocess
+
+    process = subprocess.Popen(["docker", "buildx", "imagetools", "create", "--tag", tag] + sources,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8")
+    (output, _) = process.communicate()
+    if process.wait() != 0:
+        raise RuntimeError("manifest list " + tag + " can't be created\n" + output)
+
+
+def __checkBuildx():
+    import subprocess
+    try:
+        result = subprocess.run(["docker", "buildx", "version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        result = None
+    if result is None or result.returncode != 0:
+        raise RuntimeError("docker buildx plugin not found, install it or use --legacy-builder")
+
+
+def __buildx(path, dockerfile, labels, tag, buildargs, platform, push=False, builder=None, host=None, pull=False):
     import subprocess
 
+    if builder is None and not push:
+        # Only the docker driver loads the image into the daemon where the next images look for their parents,
+        # buildx names the docker driver builder of a context after the context
+        builder = host if host and "://" not in host else "default"
+
     def join(name, values):
         array = list()
         for value in values:
@@ -566,14 +1063,17 @@ def __buildx(path, dockerfile, labels, tag, buildargs, platform):
 
     process = subprocess.Popen(["docker", "buildx", "build",
                                 "--progress", "plain",
-                                "--load",
+                                "--push" if push else "--load",
                                 "--file", dockerfile,
                                 "--tag", tag,
-                                "--platform", platform,
                                 ] +
+                               (["--platform", platform] if platform else []) +
+                               (["--builder", builder] if builder else []) +
+                               (["--pull"] if pull else []) +
                                join("--build-arg", [key + "=" + value for key, value in buildargs.items()]) +
                                join("--label", [key + "=" + value for key, value in labels.items()]) +
-                               [path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8")
+                               [path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding="utf-8",
+                               env=__dockerEnv(host))
     (output, _) = process.communicate()
     exit_code = process.wait()
     buildlog = [{'stream': output}]
@@ -587,5 +1087,80 @@ def __buildx(path, dockerfile, labels, tag, buildargs, platform):
                     break
         raise docker.errors.BuildError(reason, buildlog)
 
-    client = docker.from_env()
+    if push:
+        return None, buildlog
+    client = __dockerClient(host)
     return client.images.get(tag), buildlog
+
+
+def __parentImages(dockerfile, buildargs):
+    with open(dockerfile) as file:
+        content = file.read()
+    for key, value in buildargs.items():
+        content = content.replace("${" + key + "}", value)
+    return set(re.findall(r"^\s*FROM\s+(\S+)", content, re.MULTILINE + re.IGNORECASE) +
+               re.findall(r"--from=(\S+)", content))
+
+
+def __buildHost(host):
+    if "://" not in host:
+        __dockerContext(host)
+    return host
+
+
+def __dockerContext(name):
+    import docker.context
+    context = docker.context.ContextAPI.get_context(name)
+    if context is None:
+        raise RuntimeError("docker context " + name + " not found")
+    return context
+
+
+def __dockerClient(host, timeout=None):
+    kwargs = {"timeout": timeout} if timeout else {}
+    if host is None:
+        return docker.from_env(**kwargs)
+    if "://" in host:
+        # TLS settings come from DOCKER_TLS_VERIFY and DOCKER_CERT_PATH like the docker cli
+        kwargs.update({key: value for key, value in docker.utils.kwargs_from_env().items() if key == "tls"})
+        return docker.DockerClient(base_url=host, **kwargs)
+    context = __dockerContext(host)
+    return docker.DockerClient(base_url=context.Host, tls=context.TLSConfig, **kwargs)
+
+
+def __dockerEnv(host):
+    if host is None:
+        return None
+    env = dict(os.environ)
+    if "://" in host:
+        env["DOCKER_HOST"] = host
+        env.pop("DOCKER_CONTEXT", None)
+    else:
+        env["DOCKER_CONTEXT"] = host
+        env.pop("DOCKER_HOST", None)
+    return env
+
+
+class _BuildHosts:
+    def __init__(self, hosts):
+        self.__load = dict.fromkeys(hosts, 0)
+        self.__built = set()
+        self.__lock = threading.Lock()
+
+    def add(self, image):
+        with self.__lock:
+            self.__built.add(image)
+
+    def built(self):
+        with self.__lock:
+            return set(self.__built)
+
+    def acquire(self):
+        with self.__lock:
+            host = min(self.__load, key=lambda h: self.__load[h])
+            self.__load[host] += 1
+            return host
+
+    def release(self, host):
+        with self.__lock:
+            self.__load[host] -= 1
@@ -1,8 +1,13 @@
+import glob
+import json
 import os
-import sys
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
 
+import ignis.deploy.health as health
 import ignis.deploy.utils as utils
 
 MESOS_IMAGE_NAME = "mesos-base"
@@ -14,15 +19,25 @@ CONTAINER_DATA = "/var/lib/ignis/mesos/"
 SINGULARITY_LOG = "/var/log/ignis/singularity/"
 SINGULARITY_CONF = "/etc/ignis/singularity/"
 RESOURCES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
+RESERVED_CPUS = 1
+RESERVED_MEM_MIN = 1024
+RESERVED_DISK = 5 * 1024
+SERVICE_CPUS = 0.5
+SERVICE_MEM = 512
+SERVICE_HEAP_OVERHEAD = 256
+IMAGE_GC_INTERVAL = 3600
 
 
-def start(service, bind, quorum, name, zookeeper, resources, port_master, port_agent, port_service, no_agent, data,
-          docker_bin, url_namespace, img_tag, clear, force):
-    client = docker.from_env()
+def start(service, bind, quorum, name, zookeeper, resources, reserved_cpus, reserved_mem, reserved_disk,
+          attributes, port_master, port_agent, port_service, no_agent, data, sandbox, fetcher_cache_size,
+          fetcher_cache_dir, image_gc_headroom, gc_disk_headroom, preload, docker_bin, default_registry, url_namespace,
+          img_tag, clear, force, wait):
+    client = utils.getClient()
     container = utils.getContainer(client, CONTAINER_NAME)
     if container:
         if force:
             container.remove(force=True)
+            utils.invalidateContainers()
         else:
             print("error: " + CONTAINER_NAME + " already exists")
             exit(-1)
@@ -37,16 +52,25 @@ def start(service, bind, quorum, name, zookeeper, resources, port_master, port_a
     if data is None:
         data = CONTAINER_DATA
     data = os.path.normpath(data)
+    # Mesos keeps the executor sandboxes inside the agent work dir, a scratch disk moves the whole work dir
+    work_dir = os.path.normpath(sandbox) if sandbox else data
+    if fetcher_cache_dir is None:
+        fetcher_cache_dir = os.path.join(data, "fetch")
+    fetcher_cache_dir = os.path.normpath(fetcher_cache_dir)
+    paths = list(dict.fromkeys([data, work_dir, fetcher_cache_dir]))
     if clear:
-        utils.rmIfExists(data)
+        for path in paths:
+            utils.rmIfExists(path)
 
-    utils.mkdirIfNotExists(data)
+    for path in paths:
+        utils.mkdirIfNotExists(path)
 
     if docker_bin is None:
         docker_bin = "/usr/bin/docker"
 
-    mounts = [
-        docker.types.Mount(source=data, target=data, type="bind"),
+    mounts = [docker.types.Mount(source=path, target=path, type="bind") for path in paths
+              if path == data or not path.startswith(data + os.sep)]
+    mounts += [
         docker.types.Mount(source="/var/run/docker.sock", target="/var/run/docker.sock", type="bind"),
         docker.types.Mount(source="/sys", target="/sys", type="bind"),
         docker.types.Mount(source=docker_bin, target="/usr/bin/docker", type="bind"),
@@ -54,7 +78,7 @@ def start(service, bind, quorum, name, zookeeper, resources, port_master, port_a
 
     environment = {
         "MESOS_HOSTNAME": bind,
-        "MESOS_WD": data,
+        "MESOS_WD": work_dir,
         "PORT_MASTER": str(port_master if port_master else 5050),
         "PORT_SERVICE": str(port_service if port_service else 8080),
         "ZOOKEEPER": zookeeper
@@ -65,8 +89,31 @@ def start(service, bind, quorum, name, zookeeper, resources, port_master, port_a
         environment["MESOS_QUORUM"] = str(quorum)
     if name is not None:
         environment["MESOS_CLUSTER"] = name
-    if resources is not None:
+    if not no_agent:
+        if resources is None:
+            resources = _agentResources(client, work_dir, reserved_cpus, reserved_mem, reserved_disk)
+            print("info: agent resources " + resources + ", use --resources to override")
         environment["MESOS_RESOURCES"] = resources
+        topology = _topology()
+        if attributes:
+            topology.update(item.split(":", 1) for item in attributes.split(";") if ":" in item)
+        if topology:
+            environment["MESOS_ATTRIBUTES"] = ";".join(key + ":" + value for key, value in topology.items())
+        environment["MESOS_FETCHER_CACHE_DIR"] = fetcher_cache_dir
+        if fetcher_cache_size is not None:
+            environment["MESOS_FETCHER_CACHE_SIZE"] = str(utils.parseSize(fetcher_cache_size) // 1024 ** 2) + "MB"
+        if gc_disk_headroom is not None:
+            environment["MESOS_GC_DISK_HEADROOM"] = str(gc_disk_headroom)
+        if image_gc_headroom is not None:
+            # Only the image store of the Mesos containerizer is collected, the Docker containerizer used by the
+            # Ignis executors keeps its images in the docker daemon
+            environment["MESOS_DOCKER_STORE_DIR"] = os.path.join(data, "store", "docker")
+            environment["MESOS_IMAGE_GC_CONFIG"] = json.dumps({
+                "image_disk_headroom": image_gc_headroom,
+                "image_disk_watch_interval": {"nanoseconds": IMAGE_GC_INTERVAL * 10 ** 9}
+            })
+        if preload is not None:
+            _preload(client, preload, default_registry, url_namespace, img_tag)
 
     if quorum is None:
         image = MESOS_IMAGE_NAME
@@ -114,23 +161,156 @@ def start(service, bind, quorum, name, zookeeper, resources, port_master, port_a
         network_mode="host",
         pid_mode="host"
     )
+    utils.invalidateContainers()
+
+    if wait:
+        health.wait(CONTAINER_NAME, container, probes(), wait)
+        print("info: " + MODULE_NAME + " ready")
 
 
 def status():
-    client = docker.from_env()
+    client = utils.getClient()
     return utils.getStatus(client, CONTAINER_NAME)
 
 
+def probes():
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if not container or container.status != "running":
+        return []
+    environment = utils.getEnvironment(container)
+    result = list()
+    # Without a quorum only the agent is started
+    if "MESOS_QUORUM" in environment:
+        master = "http://" + environment["MESOS_HOSTNAME"] + ":" + environment["PORT_MASTER"]
+        result.append(("master", lambda timeout: health.mesosMaster(master, timeout)))
+    if "PORT_AGENT" in environment:
+        agent = "http://" + environment["MESOS_HOSTNAME"] + ":" + environment["PORT_AGENT"]
+        result.append(("agent", lambda timeout: health.mesosAgent(agent, timeout)))
+    return result
+
+
 def resume():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
 
 
 def stop():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
 
 
 def destroy():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
+
+
+def _agentResources(client, data, reserved_cpus, reserved_mem, reserved_disk):
+    info = client.info()
+    cpus = info["NCPU"]
+    mem = info["MemTotal"] // 1024 ** 2
+    disk = shutil.disk_usage(data).total // 1024 ** 2
+
+    if reserved_cpus is None:
+        reserved_cpus = RESERVED_CPUS
+    if reserved_mem is None:
+        # The host OS and the Docker daemon, a tenth of the memory but never less than 1g
+        reserved_mem = max(mem // 10, RESERVED_MEM_MIN)
+    else:
+        reserved_mem = utils.parseSize(reserved_mem) // 1024 ** 2
+    if reserved_disk is None:
+        reserved_disk = min(RESERVED_DISK, disk // 2)
+    else:
+        reserved_disk = utils.parseSize(reserved_disk) // 1024 ** 2
+
+    for container in utils.getContainers(client).values():
+        if container.name == CONTAINER_NAME or container.status != "running":
+            continue
+        service_cpus, service_mem = _serviceUsage(container)
+        reserved_cpus += service_cpus
+        reserved_mem += service_mem
+
+    cpus -= reserved_cpus
+    mem -= reserved_mem
+    disk -= reserved_disk
+    if cpus <= 0 or mem <= 0 or disk <= 0:
+        print("error: reservations exceed the host resources (cpus:{:g};mem:{};disk:{} left), use --resources or "
+              "lower the --reserved-* options".format(cpus, mem, disk))
+        exit(-1)
+    return "cpus:{:g};mem:{};disk:{}".format(cpus, mem, disk)
+
+
+def _serviceUsage(container):
+    host_config = container.attrs.get("HostConfig", {})
+    if host_config.get("NanoCpus"):
+        cpus = host_config["NanoCpus"] / 10 ** 9
+    elif host_config.get("CpuQuota") and host_config.get("CpuPeriod"):
+        cpus = host_config["CpuQuota"] / host_config["CpuPeriod"]
+    else:
+        cpus = SERVICE_CPUS
+    if host_config.get("Memory"):
+        mem = host_config["Memory"] // 1024 ** 2
+    else:
+        heap = utils.getEnvironment(container).get("ZK_SERVER_HEAP")
+        mem = int(heap) + SERVICE_HEAP_OVERHEAD if heap else SERVICE_MEM
+    return cpus, mem
+
+
+def _preload(client, names, default_registry, url_namespace, img_tag):
+    if not names:
+        if not default_registry:
+            print("error: --preload without images requires a registry, use --docker-registry to select one")
+            exit(-1)
+        import ignis.deploy.registry_api as registry_api
+        namespace = url_namespace[len(default_registry):]
+        try:
+            repos = registry_api.catalog(default_registry)
+        except Exception as ex:
+            print("error: " + default_registry + " catalog not available, " + str(ex))
+            exit(-1)
+        names = [repo[len(namespace):] for repo in repos if repo.startswith(namespace) and repo.endswith("-executor")]
+        if not names:
+            print("warn: no executor images found in " + default_registry)
+    images = [url_namespace + name + ("" if ":" in name else img_tag or ":latest") for name in names]
+
+    print("Preloading " + str(len(images)) + " images:")
+    lock = threading.Lock()
+
+    def pull(image):
+        repo, tag = image.rsplit(":", 1)
+        try:
+            client.images.pull(repo, tag=tag)
+            state = "PULLED"
+        except Exception as ex:
+            state = "FAILED " + str(ex)
+        with lock:
+            print("  " + image + "  " + state, flush=True)
+        return state == "PULLED"
+
+    with ThreadPoolExecutor(max_workers=max(1, len(images))) as executor:
+        pulled = [image for image, ok in zip(images, executor.map(pull, images)) if ok]
+    if len(pulled) < len(images):
+        print("warn: " + str(len(images) - len(pulled)) + " images not preloaded")
+    return pulled
+
+
+def _topology():
+    result = dict()
+    nodes = glob.glob("/sys/devices/system/node/node[0-9]*")
+    if nodes:
+        result["numa_nodes"] = str(len(nodes))
+    sockets = set()
+    for path in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/topology/physical_package_id"):
+        with open(path) as file:
+            sockets.add(file.read().strip())
+    if sockets:
+        result["sockets"] = str(len(sockets))
+    return result
+
+
+def agents(url):
+    import urllib.request
+    if not url.startswith("http"):
+        url = "http://" + url
+    with urllib.request.urlopen(url.rstrip("/") + "/master/slaves", timeout=30) as rsp:
+        return [agent["hostname"] for agent in json.load(rsp)["slaves"] if agent.get("active", True)]
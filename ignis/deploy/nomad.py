@@ -1,19 +1,20 @@
 import json
 import os
-import sys
 
 import docker
 
+import ignis.deploy.health as health
 import ignis.deploy.utils as utils
 
 IMAGE_NAME = "nomad"
 MODULE_NAME = "nomad"
 CONTAINER_NAME = "ignis-nomad"
 CONTAINER_DATA = "/var/lib/ignis/nomad/"
+HTTP = "IGNIS_NOMAD_HTTP"
 
 
 def start(bind, partner, ports, password, config_file, name, data, no_client, no_server, docker_bin, volumes,
-          url_namespace, img_tag, force, clear):
+          url_namespace, img_tag, force, clear, wait):
     if config_file is None:
         config = dict()
     else:
@@ -24,11 +25,12 @@ def start(bind, partner, ports, password, config_file, name, data, no_client, no
         print("error: " + CONTAINER_NAME + " no_agent and no_server can not be used together")
         exit(-1)
 
-    client = docker.from_env()
+    client = utils.getClient()
     container = utils.getContainer(client, CONTAINER_NAME)
     if container:
         if force:
             container.remove(force=True)
+            utils.invalidateContainers()
         else:
             print("error: " + CONTAINER_NAME + " already exists")
             exit(-1)
@@ -108,32 +110,69 @@ def start(bind, partner, ports, password, config_file, name, data, no_client, no
         environment=environment,
         privileged=True,
         command=command,
+        labels={HTTP: _httpAddress(rconfig["advertise"]["http"])},
         mounts=mounts,
         network_mode="host",
         pid_mode="host"
     )
+    utils.invalidateContainers()
+
+    if wait:
+        health.wait(CONTAINER_NAME, container, probes(), wait)
+        print("info: " + MODULE_NAME + " ready")
 
 
 def status():
-    client = docker.from_env()
+    client = utils.getClient()
     return utils.getStatus(client, CONTAINER_NAME)
 
 
+def probes():
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if not container or container.status != "running":
+        return []
+    address = container.labels.get(HTTP)
+    config_file = container.attrs["Config"]["Cmd"][-1]
+
+    def probe(timeout):
+        http = address
+        if http is None:
+            # Containers started without the label, the address is only in the config file
+            with open(config_file) as file:
+                http = _httpAddress(json.load(file).get("advertise", {}).get("http", "localhost"))
+        return health.nomad("http://" + http, timeout)
+
+    return [("/v1/status/leader", probe)]
+
+
+def _httpAddress(address):
+    return address if ":" in address else address + ":4646"
+
+
 def resume():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
 
 
 def stop():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
 
 
 def destroy():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
 
 
+def nodes(url):
+    import urllib.request
+    if not url.startswith("http"):
+        url = "http://" + url
+    with urllib.request.urlopen(url.rstrip("/") + "/v1/nodes", timeout=30) as rsp:
+        return [node["Address"] for node in json.load(rsp) if node.get("Status") == "ready"]
+
+
 class _rConfig:
     def __init__(self, config):
         self.__config = config
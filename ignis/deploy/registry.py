@@ -1,35 +1,56 @@
+import hashlib
+import json
+import os
+import re
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
 
+import ignis.deploy.health as health
+import ignis.deploy.registry_api as registry_api
 import ignis.deploy.utils as utils
 
 IMAGE_NAME = "registry:2.7.1"
+PROXY_IMAGE_NAME = "registry:3.0.0"
+REDIS_IMAGE_NAME = "redis:7.2-alpine"
 MODULE_NAME = "registry"
 CONTAINER_NAME = "ignis-registry"
+PROXY_CONTAINER_NAME = "ignis-registry-proxy"
 DEFAULT = "IGNIS_REGISTRY_DEFAULT"
 URL = "IGNIS_REGISTRY"
+PROXY = "IGNIS_REGISTRY_PROXY"
+_PLATFORM_SUFFIX = re.compile(r"-(linux|windows|darwin|freebsd)-[a-z0-9]+(-v[0-9]+)?$")
 
 
-def start(bind, port, path, default, clear, force):
-	client = docker.from_env()
-	container = utils.getContainer(client, CONTAINER_NAME)
+def start(bind, port, path, default, proxy, proxy_ttl, proxy_user, cache, redis, redis_pool, redis_memory,
+          upload_purging, max_threads, clear, force, wait):
+	name = PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME
+	client = utils.getClient()
+	container = utils.getContainer(client, name)
 	if container:
 		if force:
 			container.remove(force=True)
+			utils.invalidateContainers()
+			_redisAction(client, name, lambda container: container.remove(force=True))
 		else:
-			print("error: " + CONTAINER_NAME + " already exists")
+			print("error: " + name + " already exists")
 			exit(-1)
 
 	if bind is None:
 		bind = utils.getHostname()
 		print("info: " + bind + " selected for internal cluster communications, use --bind to select another")
 
+	if proxy and default:
+		print("warn: --default ignored, images are never pushed to the pull-through cache")
+		default = False
+
 	if port is None:
-		port = 5000
+		port = 5001 if proxy else 5000
 
 	if path is None:
-		path = "/var/lib/ignis/registry"
+		path = "/var/lib/ignis/registry-proxy" if proxy else "/var/lib/ignis/registry"
 
 	if clear:
 		utils.rmIfExists(path)
@@ -52,29 +73,124 @@ def start(bind, port, path, default, clear, force):
 		"REGISTRY_STORAGE_DELETE_ENABLED": "true"
 	}
 
+	if proxy:
+		if not proxy.startswith("http"):
+			proxy = "https://" + proxy
+		labels[PROXY] = proxy
+		environment["REGISTRY_PROXY_REMOTEURL"] = proxy
+		if proxy_ttl is not None:
+			environment["REGISTRY_PROXY_TTL"] = proxy_ttl
+		if proxy_user is not None:
+			environment["REGISTRY_PROXY_USERNAME"] = proxy_user[0]
+			environment["REGISTRY_PROXY_PASSWORD"] = proxy_user[1]
+
+	links = None
+	if cache is not None:
+		environment["REGISTRY_STORAGE_CACHE_BLOBDESCRIPTOR"] = cache
+	if cache == "redis":
+		if redis is None:
+			redis_container = utils.getContainer(client, name + "-redis")
+			if redis_container:
+				redis_container.remove(force=True)
+				utils.invalidateContainers()
+			client.containers.run(
+				image=REDIS_IMAGE_NAME,
+				name=name + "-redis",
+				detach=True,
+				command=["redis-server", "--save", "", "--appendonly", "no",
+				         "--maxmemory", redis_memory if redis_memory else "512mb",
+				         "--maxmemory-policy", "allkeys-lru"]
+			)
+			utils.invalidateContainers()
+			links = {name + "-redis": "redis"}
+			redis = "redis:6379"
+		if proxy:
+			# registry 3 uses the go-redis client options
+			environment["REGISTRY_REDIS_ADDRS"] = "[" + redis + "]"
+			if redis_pool is not None:
+				environment["REGISTRY_REDIS_MAXIDLECONNS"] = str(redis_pool[0])
+				environment["REGISTRY_REDIS_POOLSIZE"] = str(redis_pool[1])
+		else:
+			environment["REGISTRY_REDIS_ADDR"] = redis
+			if redis_pool is not None:
+				environment["REGISTRY_REDIS_POOL_MAXIDLE"] = str(redis_pool[0])
+				environment["REGISTRY_REDIS_POOL_MAXACTIVE"] = str(redis_pool[1])
+
+	if upload_purging is not None:
+		if upload_purging[0] in ("0", "off", "false"):
+			environment["REGISTRY_STORAGE_MAINTENANCE_UPLOADPURGING_ENABLED"] = "false"
+		else:
+			environment["REGISTRY_STORAGE_MAINTENANCE_UPLOADPURGING_ENABLED"] = "true"
+			environment["REGISTRY_STORAGE_MAINTENANCE_UPLOADPURGING_AGE"] = upload_purging[0]
+			environment["REGISTRY_STORAGE_MAINTENANCE_UPLOADPURGING_INTERVAL"] = upload_purging[1]
+			environment["REGISTRY_STORAGE_MAINTENANCE_UPLOADPURGING_DRYRUN"] = "false"
+
+	if max_threads is not None:
+		environment["REGISTRY_STORAGE_FILESYSTEM_ROOTDIRECTORY"] = "/var/lib/registry"
+		environment["REGISTRY_STORAGE_FILESYSTEM_MAXTHREADS"] = str(max_threads)
+
 	container = client.containers.run(
-		image=IMAGE_NAME,
-		name=CONTAINER_NAME,
+		image=PROXY_IMAGE_NAME if proxy else IMAGE_NAME,
+		name=name,
 		detach=True,
 		environment=environment,
 		labels=labels,
 		mounts=mounts,
-		ports=container_ports
+		ports=container_ports,
+		links=links
 	)
+	utils.invalidateContainers()
 
 	print('info: add \'{insecure-registries" : [ "' + bind + ":" + str(
 		port) + '" ]}\' to /etc/docker/daemon.json and restart docker daemon service')
-	print("      use " + bind + ":" + str(port) + " to refer the registry")
+	if proxy:
+		print('      add \'{registry-mirrors" : [ "http://' + bind + ":" + str(
+			port) + '" ]}\' to /etc/docker/daemon.json on every node to use it as ' + proxy + ' mirror,')
+		print("      nomad and mesos pull through the docker daemon and use the mirror too")
+	else:
+		print("      use " + bind + ":" + str(port) + " to refer the registry")
+
+	if wait:
+		health.wait(name, container, probes(proxy), wait)
+		print("info: " + name + " ready")
 
 
-def garbage():
+def garbage(keep=None, keep_versions=(), dry_run=False, proxy=False):
+	name = PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME
 	try:
-		client = docker.from_env()
-		container = utils.getContainer(client, CONTAINER_NAME)
-		if not container:
-			print(CONTAINER_NAME + " is not RUNNING", file=sys.stderr)
+		client = utils.getClient()
+		container = utils.getContainer(client, name)
+		if not container or container.status != "running":
+			print(name + " is not RUNNING", file=sys.stderr)
 			exit(-1)
-		container.exec_run(["bin/registry", "garbage-collect" "/etc/docker/registry/config.yml"])
+
+		if keep is not None and not proxy:
+			url = container.labels[URL]
+			drop = _retention(url, keep, keep_versions)
+			print("Manifests to delete:")
+			for repo, digest, dropped_tags in drop:
+				print("  " + repo + "@" + digest[:19], ", ".join(dropped_tags) or "<untagged>")
+				if not dry_run:
+					registry_api.deleteManifest(url, repo, digest)
+			print("  " + str(len(drop)) + " manifests" + (" (dry run)" if dry_run else " deleted"))
+
+		before = _storageSize(container)
+		cmd = ["/bin/registry", "garbage-collect"]
+		# Registry 2.x deletes the platform manifests of manifest lists as untagged
+		if container.attrs["Config"]["Image"].startswith("registry:3"):
+			cmd.append("--delete-untagged")
+		if dry_run:
+			cmd.append("--dry-run")
+		print("Garbage collection:")
+		exec_id = client.api.exec_create(container.id, cmd + ["/etc/docker/registry/config.yml"])["Id"]
+		for chunk in client.api.exec_start(exec_id, stream=True):
+			print(utils.decode(chunk), end="", flush=True)
+		exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+		if exit_code != 0:
+			print("error: garbage-collect fails with error " + str(exit_code), file=sys.stderr)
+			exit(-1)
+		if not dry_run:
+			print("info: " + utils.sizeFormat(before - _storageSize(container)) + " reclaimed")
 
 	except PermissionError:
 		print("root required!!", file=sys.stderr)
@@ -84,30 +200,174 @@ def garbage():
 		exit(-1)
 
 
-def status():
-	client = docker.from_env()
-	return utils.getStatus(client, CONTAINER_NAME)
+def bench(urls, layers, clients, iterations, repo):
+	if not urls:
+		client = utils.getClient()
+		container = utils.getContainer(client, CONTAINER_NAME)
+		if not container:
+			print("error: " + CONTAINER_NAME + " not found, use --url to select a registry")
+			exit(-1)
+		urls = [container.labels[URL]]
+
+	blobs = [os.urandom(utils.parseSize(size)) for size in layers]
+	config = json.dumps({"architecture": "amd64", "os": "linux", "rootfs": {"type": "layers", "diff_ids": []}})
+	blobs.insert(0, utils.encode(config))
+	descriptors = [{
+		"mediaType": "application/vnd.docker.image.rootfs.diff.tar.gzip",
+		"digest": "sha256:" + hashlib.sha256(blob).hexdigest(),
+		"size": len(blob)
+	} for blob in blobs]
+	descriptors[0]["mediaType"] = "application/vnd.docker.container.image.v1+json"
+	manifest = utils.encode(json.dumps({
+		"schemaVersion": 2,
+		"mediaType": registry_api.MANIFEST_V2,
+		"config": descriptors[0],
+		"layers": descriptors[1:]
+	}))
+	tag = "bench-" + utils.randomPassword()
+
+	print("URL                       CLIENTS  REQUESTS  TIME      REQ/S     THROUGHPUT  MANIFEST p50/p99    "
+	      "BLOB p50/p99")
+	for url in urls:
+		for blob, descriptor in zip(blobs, descriptors):
+			if not registry_api.hasBlob(url, repo, descriptor["digest"]):
+				registry_api.uploadBlob(url, repo, descriptor["digest"], blob, len(blob))
+		digest = registry_api.putManifest(url, repo, tag, registry_api.MANIFEST_V2, manifest)
+
+		def pull(_):
+			manifest_times = list()
+			blob_times = list()
+			size = 0
+			for _ in range(iterations):
+				t0 = time.perf_counter()
+				registry_api.getManifest(url, repo, tag)
+				manifest_times.append(time.perf_counter() - t0)
+				for descriptor in descriptors:
+					t0 = time.perf_counter()
+					with registry_api.getBlob(url, repo, descriptor["digest"]) as rsp:
+						while True:
+							chunk = rsp.read(1024 * 1024)
+							if not chunk:
+								break
+							size += len(chunk)
+					blob_times.append(time.perf_counter() - t0)
+			return manifest_times, blob_times, size
 
+		manifest_times = list()
+		blob_times = list()
+		size = 0
+		t0 = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=clients) as executor:
+			for m_times, b_times, b_size in executor.map(pull, range(clients)):
+				manifest_times.extend(m_times)
+				blob_times.extend(b_times)
+				size += b_size
+		elapsed = time.perf_counter() - t0
+		registry_api.deleteManifest(url, repo, digest if digest else registry_api.getManifest(url, repo, tag)[2])
 
-def resume():
-	client = docker.from_env()
-	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
+		requests = len(manifest_times) + len(blob_times)
+		print(url[:24].ljust(25), str(clients).rjust(7), str(requests).rjust(9), "",
+		      "{:.2f}s".format(elapsed).ljust(9), "{:.1f}".format(requests / elapsed).ljust(9),
+		      (utils.sizeFormat(size / elapsed) + "/s").ljust(11),
+		      (utils.msFormat(utils.percentile(manifest_times, 50)) + "/" +
+		       utils.msFormat(utils.percentile(manifest_times, 99))).ljust(19),
+		      utils.msFormat(utils.percentile(blob_times, 50)) + "/" + utils.msFormat(utils.percentile(blob_times, 99)))
+	print("info: run 'registry garbage' to remove the benchmark blobs")
 
 
-def stop():
-	client = docker.from_env()
-	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
+def _retention(url, keep, keep_versions):
+	drop = list()
+	for repo in sorted(registry_api.catalog(url)):
+		tags = dict()
+		children = dict()
+		for tag in registry_api.tags(url, repo):
+			media_type, raw, digest = registry_api.getManifest(url, repo, tag)
+			tags[tag] = digest
+			if media_type in registry_api.LIST_TYPES:
+				children[digest] = [child for child, _ in registry_api.manifestChildren(raw)]
 
+		# Platform tags (2.0-linux-arm64) belong to the version of their manifest list (2.0)
+		versions = set(_tagVersion(tag) for tag in tags) - {"latest"}
+		kept = set(sorted(versions, key=_versionKey, reverse=True)[:keep])
+		kept.update(keep_versions)
+		kept.add("latest")
 
-def destroy():
-	client = docker.from_env()
-	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
+		kept_digests = set(digest for tag, digest in tags.items() if _tagVersion(tag) in kept)
+		for digest in list(kept_digests):
+			kept_digests.update(children.get(digest, []))
+		digests = dict()
+		for tag, digest in tags.items():
+			if digest not in kept_digests:
+				digests.setdefault(digest, list()).append(tag)
+		# The platform manifests of a deleted list are deleted with it, even if they have no tag
+		for digest in list(digests):
+			for child in children.get(digest, []):
+				if child not in kept_digests:
+					digests.setdefault(child, list())
+		for digest, dropped_tags in digests.items():
+			drop.append((repo, digest, sorted(dropped_tags)))
+	return drop
+
+
+def _tagVersion(tag):
+	return _PLATFORM_SUFFIX.sub("", tag)
+
+
+def _versionKey(version):
+	return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"[.\-_]", version)]
+
+
+def _storageSize(container):
+	_, output = container.exec_run(["du", "-sk", "/var/lib/registry"])
+	return int(utils.decode(output).split()[0]) * 1024
+
+
+def status(proxy=False):
+	client = utils.getClient()
+	return utils.getStatus(client, PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME)
+
+
+def probes(proxy=False):
+	client = utils.getClient()
+	container = utils.getContainer(client, PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME)
+	if not container or container.status != "running":
+		return []
+	url = container.labels[URL]
+	return [("/v2/", lambda timeout: health.registry(url, timeout))]
+
+
+def resume(proxy=False):
+	client = utils.getClient()
+	name = PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME
+	_redisAction(client, name, lambda container: container.start())
+	utils.containerAction(client, name, MODULE_NAME, lambda container: container.start())
+
+
+def stop(proxy=False):
+	client = utils.getClient()
+	name = PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME
+	utils.containerAction(client, name, MODULE_NAME, lambda container: container.stop())
+	_redisAction(client, name, lambda container: container.stop())
+
+
+def destroy(proxy=False):
+	client = utils.getClient()
+	name = PROXY_CONTAINER_NAME if proxy else CONTAINER_NAME
+	utils.containerAction(client, name, MODULE_NAME, lambda container: container.remove(force=True))
+	_redisAction(client, name, lambda container: container.remove(force=True))
+
+
+def _redisAction(client, name, action):
+	container = utils.getContainer(client, name + "-redis")
+	if container:
+		action(container)
+		utils.invalidateContainers()
 
 
 def parse(r):
 	if r is None:
 		r = ""
-		client = docker.from_env()
+		client = utils.getClient()
 		container = utils.getContainer(client, CONTAINER_NAME)
 		if container:
 			if DEFAULT in container.labels:
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+
+MANIFEST_V2 = "application/vnd.docker.distribution.manifest.v2+json"
+MANIFEST_LIST_V2 = "application/vnd.docker.distribution.manifest.list.v2+json"
+OCI_MANIFEST = "application/vnd.oci.image.manifest.v1+json"
+OCI_INDEX = "application/vnd.oci.image.index.v1+json"
+MANIFEST_TYPES = [MANIFEST_V2, MANIFEST_LIST_V2, OCI_MANIFEST, OCI_INDEX]
+LIST_TYPES = [MANIFEST_LIST_V2, OCI_INDEX]
+
+
+def parseUrl(url):
+    if url.endswith("/"):
+        url = url[:-1]
+    if not url.startswith("http"):
+        url = "http://" + url
+    return url
+
+
+def request(url, path, method="GET", data=None, headers=None, timeout=60):
+    parsed = urllib.parse.urlparse(parseUrl(url))
+    headers = dict(headers) if headers else dict()
+    if parsed.username:
+        credentials = parsed.username + ":" + (parsed.password or "")
+        headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("utf-8")
+        parsed = parsed._replace(netloc=parsed.hostname + (":" + str(parsed.port) if parsed.port else ""))
+    target = path if path.startswith("http") else urllib.parse.urlunparse(parsed) + path
+    req = urllib.request.Request(target, data=data, headers=headers, method=method)
+    return urllib.request.urlopen(req, timeout=timeout)
+
+
+def ping(url, timeout=5):
+    try:
+        with request(url, "/v2/", timeout=timeout) as rsp:
+            return rsp.status == 200
+    except urllib.error.HTTPError as ex:
+        return ex.code == 401
+    except OSError:
+        return False
+
+
+def catalog(url):
+    repos = list()
+    path = "/v2/_catalog?n=1000"
+    while path:
+        with request(url, path) as rsp:
+            repos.extend(json.load(rsp).get("repositories") or [])
+            path = __nextLink(rsp)
+    return repos
+
+
+def tags(url, repo):
+    result = list()
+    path = "/v2/" + repo + "/tags/list?n=1000"
+    while path:
+        try:
+            with request(url, path) as rsp:
+                result.extend(json.load(rsp).get("tags") or [])
+                path = __nextLink(rsp)
+        except urllib.error.HTTPError as ex:
+            if ex.code == 404:
+                break
+            raise
+    return result
+
+
+def getManifest(url, repo, reference):
+    headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+    with request(url, "/v2/" + repo + "/manifests/" + reference, headers=headers) as rsp:
+        raw = rsp.read()
+        media_type = rsp.headers.get("Content-Type", "").split(";")[0]
+    manifest = json.loads(raw)
+    if manifest.get("mediaType"):
+        media_type = manifest["mediaType"]
+    return media_type, raw, "sha256:" + hashlib.sha256(raw).hexdigest()
+
+
+def putManifest(url, repo, reference, media_type, raw):
+    with request(url, "/v2/" + repo + "/manifests/" + reference, method="PUT", data=raw,
+                 headers={"Content-Type": media_type}) as rsp:
+        return rsp.headers.get("Docker-Content-Digest")
+
+
+def deleteManifest(url, repo, digest):
+    with request(url, "/v2/" + repo + "/manifests/" + digest, method="DELETE") as rsp:
+        return rsp.status == 202
+
+
+def manifestBlobs(raw):
+    manifest = json.loads(raw)
+    blobs = list()
+    if "config" in manifest:
+        blobs.append((manifest["config"]["digest"], manifest["config"].get("size", 0)))
+    for layer in manifest.get("layers", []):
+        blobs.append((layer["digest"], layer.get("size", 0)))
+    return blobs
+
+
+def manifestChildren(raw):
+    return [(child["digest"], child["mediaType"]) for child in json.loads(raw).get("manifests", [])]
+
+
+def hasBlob(url, repo, digest):
+    try:
+        with request(url, "/v2/" + repo + "/blobs/" + digest, method="HEAD") as rsp:
+            return rsp.status == 200
+    except urllib.error.HTTPError as ex:
+        if ex.code == 404:
+            return False
+        raise
+
+
+def getBlob(url, repo, digest):
+    return request(url, "/v2/" + repo + "/blobs/" + digest, timeout=600)
+
+
+def mountBlob(url, repo, digest, source_repo):
+    path = "/v2/" + repo + "/blobs/uploads/?mount=" + digest + "&from=" + source_repo
+    with request(url, path, method="POST", data=b"") as rsp:
+        if rsp.status == 201:
+            return True
+        location = rsp.headers["Location"]
+    # Mount refused, the registry opened a regular upload session
+    __closeUpload(url, location)
+    return False
+
+
+def uploadBlob(url, repo, digest, data, size):
+    with request(url, "/v2/" + repo + "/blobs/uploads/", method="POST", data=b"") as rsp:
+        location = rsp.headers["Location"]
+    separator = "&" if "?" in location else "?"
+    with request(url, location + separator + "digest=" + digest, method="PUT", data=data, timeout=600,
+                 headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)}) as rsp:
+        return rsp.status == 201
+
+
+def __closeUpload(url, location):
+    try:
+        with request(url, location, method="DELETE"):
+            pass
+    except urllib.error.HTTPError:
+        pass
+
+
+def __nextLink(rsp):
+    link = rsp.headers.get("Link")
+    if not link:
+        return None
+    return link[link.index("<") + 1:link.index(">")]
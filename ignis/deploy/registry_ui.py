@@ -1,7 +1,4 @@
-import sys
-
-import docker
-
+import ignis.deploy.health as health
 import ignis.deploy.utils as utils
 
 IMAGE_NAME = "joxit/docker-registry-ui:2.1.0"
@@ -9,12 +6,13 @@ MODULE_NAME = "registry-ui"
 CONTAINER_NAME = "ignis-registry-ui"
 
 
-def start(port, registry, force):
-	client = docker.from_env()
+def start(port, registry, force, wait):
+	client = utils.getClient()
 	container = utils.getContainer(client, CONTAINER_NAME)
 	if container:
 		if force:
 			container.remove(force=True)
+			utils.invalidateContainers()
 		else:
 			print("error: " + CONTAINER_NAME + " already exists")
 			exit(-1)
@@ -55,23 +53,37 @@ def start(port, registry, force):
 		environment=environment,
 		ports=container_ports
 	)
+	utils.invalidateContainers()
+
+	if wait:
+		health.wait(CONTAINER_NAME, container, probes(), wait)
+		print("info: " + MODULE_NAME + " ready")
 
 
 def status():
-	client = docker.from_env()
+	client = utils.getClient()
 	return utils.getStatus(client, CONTAINER_NAME)
 
 
+def probes():
+	client = utils.getClient()
+	container = utils.getContainer(client, CONTAINER_NAME)
+	if not container or container.status != "running":
+		return []
+	url = "http://localhost:" + str(utils.getHostPort(container, 80))
+	return [("http", lambda timeout: str(health.http(url, timeout)[0]))]
+
+
 def resume():
-	client = docker.from_env()
+	client = utils.getClient()
 	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
 
 
 def stop():
-	client = docker.from_env()
+	client = utils.getClient()
 	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
 
 
 def destroy():
-	client = docker.from_env()
+	client = utils.getClient()
 	utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
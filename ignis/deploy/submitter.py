@@ -2,6 +2,7 @@ import os
 
 import docker
 
+import ignis.deploy.health as health
 import ignis.deploy.utils as utils
 
 IMAGE_NAME = "submitter"
@@ -10,12 +11,13 @@ CONTAINER_NAME = "ignis-submitter"
 
 
 def start(port, dfs, dfs_home, password, scheduler, shceduler_url, dns, envs, mounts, default_registry, url_namespace,
-          img_tag, force):
-    client = docker.from_env()
+          img_tag, force, wait):
+    client = utils.getClient()
     container = utils.getContainer(client, CONTAINER_NAME)
     if container:
         if force:
             container.remove(force=True)
+            utils.invalidateContainers()
         else:
             print("error: " + CONTAINER_NAME + " already exists")
             exit(-1)
@@ -84,27 +86,41 @@ def start(port, dfs, dfs_home, password, scheduler, shceduler_url, dns, envs, mo
         ports=container_ports,
         extra_hosts=extra_hosts
     )
+    utils.invalidateContainers()
 
     container.exec_run(["bash", "-c", 'echo "root:' + password + '" | chpasswd'])
 
+    if wait:
+        health.wait(CONTAINER_NAME, container, probes(), wait)
+        print("info: " + MODULE_NAME + " ready")
+
 
 def status():
-    client = docker.from_env()
+    client = utils.getClient()
     return utils.getStatus(client, CONTAINER_NAME)
 
 
+def probes():
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if not container or container.status != "running":
+        return []
+    port = utils.getHostPort(container, 22)
+    return [("ssh", lambda timeout: health.ssh("localhost", port, timeout))]
+
+
 def resume():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
 
 
 def stop():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
 
 
 def destroy():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
 
 
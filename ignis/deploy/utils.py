@@ -7,6 +7,11 @@ import socket
 import string
 import subprocess
 
+import docker
+
+_client = None
+_containers = None
+
 
 def getHostname():
     try:
@@ -19,12 +24,53 @@ def getIpAddress(hostname):
     return socket.gethostbyname(hostname)
 
 
+def getLocalAddresses():
+    addresses = {"127.0.0.1"}
+    try:
+        addresses.update(socket.gethostbyname_ex(getHostname())[2])
+    except socket.error:
+        pass
+    return addresses
+
+
+def getClient():
+    global _client
+    if _client is None:
+        _client = docker.from_env()
+    return _client
+
+
 def getContainer(client, name):
+    if name.startswith("ignis-"):
+        return getContainers(client).get(name)
     containers = client.containers.list(all=True, filters={'name': '^' + name + '$'})
     if len(containers) == 1:
         return containers.pop()
 
 
+def invalidateContainers():
+    global _containers
+    _containers = None
+
+
+def getContainers(client):
+    global _containers
+    # Only the containers of the local client are cached, remote clients always list their own host
+    if client is not _client:
+        return _listContainers(client)
+    if _containers is None:
+        _containers = _listContainers(client)
+    return _containers
+
+
+def _listContainers(client):
+    containers = dict()
+    # docker-py inspects every listed container, the snapshot avoids repeating it for each lookup
+    for container in client.containers.list(all=True, filters={'name': '^ignis-'}):
+        containers[container.name] = container
+    return containers
+
+
 def getStatus(client, name):
     container = getContainer(client, name)
     if not container:
@@ -32,11 +78,23 @@ def getStatus(client, name):
     return container.status.upper()
 
 
+def getEnvironment(container):
+    return dict(env.split("=", 1) for env in container.attrs["Config"].get("Env") or [])
+
+
+def getHostPort(container, port):
+    bindings = (container.attrs["NetworkSettings"].get("Ports") or {}).get(str(port) + "/tcp")
+    if bindings:
+        return int(bindings[0]["HostPort"])
+    return None
+
+
 def containerAction(client, name, module, action):
     container = getContainer(client, name)
     if container:
         try:
             action(container)
+            invalidateContainers()
         except Exception as ex:
             print("error:  " + str(ex))
             exit(-1)
@@ -65,6 +123,33 @@ def sha256base64(s):
     return decode(base64.b64encode(hashlib.sha256(encode(s)).digest()))
 
 
+def parseSize(size):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    size = size.upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def sizeFormat(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024.0
+    return "{:.1f} {}".format(size, "TB")
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def msFormat(seconds):
+    return "{:.1f}ms".format(seconds * 1000)
+
+
 def mkdirIfNotExists(path):
     if not os.path.exists(path):
         os.makedirs(path, True)
@@ -1,11 +1,18 @@
+import io
+import json
 import os
-import shutil
-import sys
+import tarfile
+import threading
 import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 import docker
+import docker.errors
 
+import ignis.deploy.health as health
 import ignis.deploy.utils as utils
+import ignis.deploy.zookeeper_api as zookeeper_api
 
 IMAGE_NAME = "zookeeper"
 MODULE_NAME = "zookeeper"
@@ -13,18 +20,74 @@ CONTAINER_NAME = "ignis-zookeeper"
 CONTAINER_LOG = "/var/log/ignis/zookeeper/"
 CONTAINER_CONF = "/etc/ignis/zookeeper/"
 CONTAINER_DATA = "/var/lib/ignis/zookeeper/"
+HEAP_MIN = 512
+HEAP_MAX = 8192
+CLIENT = "IGNIS_ZOOKEEPER_CLIENT"
+SERVER = "IGNIS_ZOOKEEPER_SERVER"
+JOIN_TIMEOUT = 60
+QUORUM_TIMEOUT = 300
+BENCH_WORKLOADS = ["create", "set", "get", "delete"]
 RESOURCES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "resources")
 
 
-def start(bind, id, partner, password, ports, logs, conf, data, url_namespace, img_tag, clear, force):
-    client = docker.from_env()
-    container = utils.getContainer(client, CONTAINER_NAME)
-    if container:
-        if force:
-            container.remove(force=True)
-        else:
-            print("error: " + CONTAINER_NAME + " already exists")
+def start(bind, id, partner, members, observer, password, ports, logs, conf, data, data_log, heap, snap_count,
+          prealloc_size, outstanding_limit, autopurge, metrics_port, endpoint, url_namespace, img_tag, clear, force,
+          wait):
+    if ports is None:
+        ports = [
+            2888,
+            3888,
+            2181,
+        ]
+
+    if logs is None:
+        logs = CONTAINER_LOG
+
+    if conf is None:
+        conf = CONTAINER_CONF
+
+    if data is None:
+        data = CONTAINER_DATA
+
+    image = url_namespace + IMAGE_NAME + img_tag
+
+    settings = dict()
+    if data_log is not None:
+        settings["dataLogDir"] = "/var/lib/zookeeper/datalog/"
+    if snap_count is not None:
+        settings["snapCount"] = str(snap_count)
+    if prealloc_size is not None:
+        settings["preAllocSize"] = str(utils.parseSize(prealloc_size) // 1024)
+    if outstanding_limit is not None:
+        settings["globalOutstandingLimit"] = str(outstanding_limit)
+    if autopurge is not None:
+        settings["autopurge.snapRetainCount"] = str(autopurge[0])
+        settings["autopurge.purgeInterval"] = str(autopurge[1])
+    if metrics_port is not None:
+        settings["metricsProvider.className"] = "org.apache.zookeeper.metrics.prometheus.PrometheusMetricsProvider"
+        settings["metricsProvider.httpPort"] = str(metrics_port)
+        settings["metricsProvider.exportJvmInfo"] = "true"
+    tuning = (data_log, heap, settings)
+
+    if members:
+        if partner is not None:
+            print("error: --members and --partner can not be used together")
             exit(-1)
+        if password is None:
+            password = utils.randomPassword()
+            print("info: super password " + password + " generated, it is required to add new servers")
+        _ensemble(members, password, ports, logs, conf, data, tuning, endpoint, image, clear, force, wait)
+        return
+
+    if observer and partner is None:
+        print("error: an observer must join an existing ensemble, use --partner")
+        exit(-1)
+
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if container and not force:
+        print("error: " + CONTAINER_NAME + " already exists")
+        exit(-1)
 
     if bind is None:
         bind = utils.getHostname()
@@ -41,19 +104,8 @@ def start(bind, id, partner, password, ports, logs, conf, data, url_namespace, i
     if password is None:
         password = utils.randomPassword()
 
-    zk_token = "super:" + utils.sha1base64("super:" + password)
-
-    if ports is None:
-        ports = [
-            2888,
-            3888,
-            2181,
-        ]
-    container_ports = dict()
-    for port in ports:
-        container_ports[str(port)] = str(port)
-
-    my_server = "server." + id + "=" + bind + ":" + str(ports[0]) + ":" + str(ports[1]) + ";" + str(ports[2])
+    my_server = _server(id, bind, ports, observer)
+    dynamic = my_server + "\n"
 
     if type(partner) == str:
         partner_ip = utils.getIpAddress(partner)
@@ -61,101 +113,517 @@ def start(bind, id, partner, password, ports, logs, conf, data, url_namespace, i
             print("error:  hostname '" + partner + "' not found")
             exit(-1)
         partner_id = partner_ip.split('.')[3]
-        partner_server = "server." + partner_id + "=" + partner + ":" + str(ports[0]) + ":" + str(ports[1]) + ";" + \
-                         str(ports[2])
+        dynamic += "server." + partner_id + "=" + partner + ":" + str(ports[0]) + ":" + str(ports[1]) + ";" + \
+                   str(ports[2])
+        partner_client = (partner, ports[2])
     elif type(partner) == list:
         partner_ip = utils.getIpAddress(partner[1])
         if not partner_ip:
             print("error:  hostname '" + partner[1] + "' not found")
             exit(-1)
-        partner_server = "server." + partner[0] + "=" + partner_ip + ":" + partner[2] + ":" + partner[3] + ";" + \
-                         partner[4]
+        dynamic += "server." + partner[0] + "=" + partner_ip + ":" + partner[2] + ":" + partner[3] + ";" + \
+                   partner[4]
+        partner_client = (partner_ip, partner[4])
 
-    if logs is None:
-        logs = CONTAINER_LOG
+    container = _member(client, True, id, bind, observer, dynamic, password, ports, logs, conf, data, tuning, image,
+                        clear, force)
 
-    if conf is None:
-        conf = CONTAINER_CONF
+    if partner is not None:
+        try:
+            health.wait(CONTAINER_NAME, container,
+                        [("ruok", lambda timeout: health.zookeeperPort(bind, ports[2], timeout))], JOIN_TIMEOUT)
+            reconfig(partner_client, password, joining=[my_server])
+        except Exception as ex:
+            print("error: failed to join to the partner " + str(ex))
+            destroy()
+            exit(-1)
 
-    if data is None:
-        data = CONTAINER_DATA
+    if wait:
+        health.wait(CONTAINER_NAME, container, probes(), wait)
+        print("info: " + MODULE_NAME + " ready")
+
+
+def _ensemble(members, password, ports, logs, conf, data, tuning, endpoint, image, clear, force, wait):
+    servers = list()
+    for member in members:
+        id, _, host = member.rpartition("=")
+        observer = host.endswith(":observer")
+        if observer:
+            host = host[:-len(":observer")]
+        # Members given as docker urls (tcp://node:2376) keep the url for the docker client
+        ip = utils.getIpAddress(urllib.parse.urlsplit(host).hostname if "://" in host else host)
+        servers.append((id if id else ip.split('.')[3], host, ip, observer))
+    ids = [server[0] for server in servers]
+    if len(set(ids)) != len(ids):
+        print("error: duplicated zookeeper server ids " + ",".join(ids) + ", use id=address to set them")
+        exit(-1)
 
-    if clear:
-        utils.rmIfExists(logs)
-        utils.rmIfExists(conf)
-        utils.rmIfExists(data)
+    dynamic = "".join(_server(id, ip, ports, observer) + "\n" for id, _, ip, observer in servers)
+    local_addresses = utils.getLocalAddresses()
+    lock = threading.Lock()
 
-    utils.mkdirIfNotExists(logs)
-    utils.mkdirIfNotExists(conf)
-    utils.mkdirIfNotExists(data)
+    def deploy(server):
+        id, host, ip, observer = server
+        if ip in local_addresses:
+            client = utils.getClient()
+        else:
+            client = docker.DockerClient(base_url=host if "://" in host else endpoint.format(host), timeout=600)
+        _member(client, ip in local_addresses, id, ip, observer, dynamic, password, ports, logs, conf, data, tuning,
+                image, clear, force)
+        with lock:
+            print("  " + host + "  server." + id + (" observer" if observer else "") + " started", flush=True)
+
+    print("Starting " + str(len(servers)) + " zookeeper servers:")
+    failed = list()
+    with ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        wait_list = [(server, executor.submit(deploy, server)) for server in servers]
+        for server, future in wait_list:
+            try:
+                future.result()
+            except Exception as ex:
+                print("  " + server[1] + "  FAILED " + str(ex), flush=True)
+                failed.append(server[1])
+    if failed:
+        print("error: zookeeper failed on " + ", ".join(failed))
+        exit(-1)
 
+    participants = [server for server in servers if not server[3]]
+    if not participants:
+        print("error: an ensemble needs at least one participant")
+        exit(-1)
+    quorum = len(participants) // 2 + 1
+    serving = list()
+    for _ in health.backoff(wait if wait else QUORUM_TIMEOUT):
+        serving = list()
+        for id, host, ip, observer in servers:
+            try:
+                serving.append(host + " " + health.zookeeper(ip, ports[2], health.TIMEOUT).split(",")[0])
+            except Exception:
+                pass
+        if len([server for server in serving if not server.endswith(" observer")]) >= quorum:
+            print("info: quorum reached, " + ", ".join(serving))
+            return
+    print("error: quorum not reached, " + str(len(serving)) + "/" + str(len(servers)) + " servers serving")
+    exit(-1)
+
+
+def _member(client, local, id, bind, observer, dynamic, password, ports, logs, conf, data, tuning, image, clear,
+            force):
+    data_log, heap, settings = tuning
+    if local:
+        container = utils.getContainer(client, CONTAINER_NAME)
+    else:
+        container = next(iter(client.containers.list(all=True, filters={'name': '^' + CONTAINER_NAME + '$'})), None)
+    if container:
+        if force:
+            container.remove(force=True)
+            utils.invalidateContainers()
+        else:
+            raise RuntimeError(CONTAINER_NAME + " already exists")
+
+    conf_files = {"zoo.cfg.dynamic": dynamic.encode("utf-8")}
     zookeeper_res = os.path.join(RESOURCES, "zookeeper")
-    with open(os.path.join(zookeeper_res, 'myid'), 'w') as f:
-        f.write(str(id))
-    with open(os.path.join(zookeeper_res, 'zoo.cfg.dynamic'), 'w') as f:
-        f.write(my_server + "\n")
-        if partner:
-            f.write(partner_server)
     for filename in os.listdir(zookeeper_res):
-        shutil.copy(os.path.join(zookeeper_res, filename), conf)
-    shutil.move(os.path.join(conf, 'myid'), os.path.join(os.path.abspath(data),'myid'))
-
-    mounts = [
-        docker.types.Mount(source=logs, target="/var/log/zookeeper/", type="bind"),
-        docker.types.Mount(source=conf, target="/etc/zookeeper/conf/", type="bind"),
-        docker.types.Mount(source=data, target="/var/lib/zookeeper/data/", type="bind"),
-    ]
+        if filename not in ("myid", "zoo.cfg.dynamic", "__init__.py") and \
+                os.path.isfile(os.path.join(zookeeper_res, filename)):
+            with open(os.path.join(zookeeper_res, filename), "rb") as file:
+                conf_files[filename] = file.read()
+    if observer:
+        settings = dict(settings, peerType="observer")
+    conf_files["zoo.cfg"] = _zooCfg(conf_files["zoo.cfg"], settings)
+    data_files = {"myid": str(id).encode("utf-8")}
 
+    zk_token = "super:" + utils.sha1base64("super:" + password)
+    heap_mb = _heapSize(client, heap)
     environment = {
         "JVMFLAGS": "-Djava.security.auth.login.config=/etc/zookeeper/conf/jaas.conf  "
-                    "-Dzookeeper.DigestAuthenticationProvider.superDigest=" + zk_token,
+                    "-Dzookeeper.DigestAuthenticationProvider.superDigest=" + zk_token +
+                    " -Xms" + str(heap_mb) + "m -Xmx" + str(heap_mb) + "m",
+        "ZK_SERVER_HEAP": str(heap_mb),
     }
 
     command = ["/opt/zookeeper/bin/zkServer.sh", "start-foreground"]
 
-    container = client.containers.run(
-        image=url_namespace + IMAGE_NAME + img_tag,
+    container_ports = dict()
+    for port in ports:
+        container_ports[str(port)] = str(port)
+    if "metricsProvider.httpPort" in settings:
+        container_ports[settings["metricsProvider.httpPort"]] = settings["metricsProvider.httpPort"]
+
+    options = dict(
+        image=image,
         name=CONTAINER_NAME,
         detach=True,
         environment=environment,
         privileged=True,
         command=command,
-        mounts=mounts,
-        ports=container_ports
+        ports=container_ports,
+        labels={CLIENT: bind + ":" + str(ports[2]), SERVER: _server(id, bind, ports, observer)}
     )
 
-    if partner is not None:
-        partner_check = False
-        for i in range(1, 11):
-            time.sleep(i % 5)
-            _, pipe = container.exec_run(["/opt/ignis/bin/auth-cli.sh"], socket=True, stdin=True)
-            pipe._sock.sendall(utils.encode(str(ports[2]) + "\n"))
-            pipe._sock.sendall(utils.encode("addauth digest super:" + password + "\n"))
-            pipe._sock.sendall(utils.encode("reconfig -add " + my_server + "\n"))
-            out = pipe.readlines()
-            if "Committed new configuration" in str(out):
-                partner_check = True
-                break
-        if not partner_check:
-            print("error: failed to join to the partner " + str(out))
-            destroy()
+    if local:
+        if clear:
+            utils.rmIfExists(logs)
+            utils.rmIfExists(conf)
+            utils.rmIfExists(data)
+
+        utils.mkdirIfNotExists(logs)
+        utils.mkdirIfNotExists(conf)
+        utils.mkdirIfNotExists(data)
+        if data_log is not None:
+            if clear:
+                utils.rmIfExists(data_log)
+            utils.mkdirIfNotExists(data_log)
+
+        for folder, files in [(conf, conf_files), (data, data_files)]:
+            for filename, content in files.items():
+                with open(os.path.join(folder, filename), "wb") as file:
+                    file.write(content)
+
+        mounts = [
+            docker.types.Mount(source=logs, target="/var/log/zookeeper/", type="bind"),
+            docker.types.Mount(source=conf, target="/etc/zookeeper/conf/", type="bind"),
+            docker.types.Mount(source=data, target="/var/lib/zookeeper/data/", type="bind"),
+        ]
+        if data_log is not None:
+            mounts.append(docker.types.Mount(source=data_log, target="/var/lib/zookeeper/datalog/", type="bind"))
+        container = client.containers.run(mounts=mounts, **options)
+        utils.invalidateContainers()
+        return container
+
+    # Remote hosts: the directories are created by docker and the files are copied through the daemon
+    volumes = {
+        logs: {"bind": "/var/log/zookeeper/", "mode": "rw"},
+        conf: {"bind": "/etc/zookeeper/conf/", "mode": "rw"},
+        data: {"bind": "/var/lib/zookeeper/data/", "mode": "rw"},
+    }
+    if data_log is not None:
+        volumes[data_log] = {"bind": "/var/lib/zookeeper/datalog/", "mode": "rw"}
+    if clear:
+        client.containers.run(image=image, entrypoint=["sh", "-c"], remove=True, volumes=volumes,
+                              command=["rm -rf /var/log/zookeeper/* /etc/zookeeper/conf/* /var/lib/zookeeper/data/* "
+                                       "/var/lib/zookeeper/datalog/*"])
+    else:
+        try:
+            client.images.get(image)
+        except docker.errors.ImageNotFound:
+            client.images.pull(image)
+    options.pop("detach")
+    container = client.containers.create(volumes=volumes, **options)
+    container.put_archive("/etc/zookeeper/conf/", _tarFiles(conf_files))
+    container.put_archive("/var/lib/zookeeper/data/", _tarFiles(data_files))
+    container.start()
+    return container
+
+
+def _zooCfg(content, settings):
+    lines = content.decode("utf-8").splitlines()
+    pending = dict(settings)
+    for i, line in enumerate(lines):
+        key = line.split("=", 1)[0].strip()
+        if key in pending:
+            lines[i] = key + "=" + pending.pop(key)
+    lines.extend(key + "=" + value for key, value in pending.items())
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _heapSize(client, heap):
+    if heap is None or heap == "auto":
+        # A quarter of the host memory leaves room for the page cache used by the transaction log
+        memory = client.info()["MemTotal"] // 1024 ** 2
+        return min(max(memory // 4, HEAP_MIN), HEAP_MAX)
+    return utils.parseSize(heap) // 1024 ** 2
+
+
+def _tarFiles(files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for filename, content in files.items():
+            info = tarfile.TarInfo(filename)
+            info.size = len(content)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def reconfig(address, password, joining=(), leaving=(), timeout=JOIN_TIMEOUT):
+    host, port = address
+    error = None
+    for _ in health.backoff(timeout):
+        try:
+            with zookeeper_api.Client(host, port) as zk:
+                zk.addAuth("digest", "super:" + password)
+                servers, version = zk.getConfig()
+                joining = [server for server in joining if not _isMember(servers, server)]
+                leaving = [id for id in leaving if str(id) in servers]
+                if not joining and not leaving:
+                    return servers
+                servers, _ = zk.reconfig(joining=",".join(joining) if joining else None,
+                                         leaving=",".join(map(str, leaving)) if leaving else None,
+                                         version=version)
+                return servers
+        except zookeeper_api.ZookeeperError as ex:
+            if ex.code not in zookeeper_api.CONFLICTS:
+                raise
+            error = ex
+        except OSError as ex:
+            error = ex
+    raise RuntimeError("reconfig not committed after " + str(timeout) + "s: " + str(error))
+
+
+def leave(password):
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if not container or SERVER not in container.labels:
+        print("error: " + MODULE_NAME + " not found")
+        exit(-1)
+    id = container.labels[SERVER][len("server."):].split("=")[0]
+    try:
+        reconfig(_clientAddress(container), password, leaving=[id])
+    except Exception as ex:
+        print("error: failed to leave the ensemble " + str(ex))
+        exit(-1)
+    print("info: server." + id + " removed from the ensemble, it can be destroyed")
+
+
+def stats(server, output_json):
+    if server is None:
+        client = utils.getClient()
+        container = utils.getContainer(client, CONTAINER_NAME)
+        if not container:
+            print("error: " + MODULE_NAME + " not found, use --server")
+            exit(-1)
+        address = _clientAddress(container)
+    else:
+        host, _, port = server.partition(":")
+        address = (host, int(port) if port else 2181)
+
+    with zookeeper_api.Client(*address) as zk:
+        servers, _ = zk.getConfig()
+
+    members = list()
+    for id, spec in sorted(servers.items(), key=lambda item: int(item[0]) if item[0].isdigit() else item[0]):
+        quorum_address, _, client_address = spec.partition(";")
+        client_host, _, client_port = client_address.rpartition(":")
+        if client_host in ("", "0.0.0.0"):
+            client_host = quorum_address.split(":")[0]
+        members.append((id, client_host, int(client_port)))
+
+    def query(member):
+        try:
+            return health.mntr(member[1], member[2], health.TIMEOUT)
+        except Exception as ex:
+            return {"zk_server_state": "unavailable", "error": str(ex)}
+
+    with ThreadPoolExecutor(max_workers=len(members)) as executor:
+        results = list(executor.map(query, members))
+
+    rows = list()
+    for (id, host, port), metrics in zip(members, results):
+        rows.append({
+            "server": id,
+            "address": host + ":" + str(port),
+            "state": metrics["zk_server_state"],
+            "avg_latency": _metric(metrics, "zk_avg_latency"),
+            "max_latency": _metric(metrics, "zk_max_latency"),
+            "outstanding_requests": _metric(metrics, "zk_outstanding_requests"),
+            "znodes": _metric(metrics, "zk_znode_count"),
+            "connections": _metric(metrics, "zk_num_alive_connections"),
+            "avg_fsync": _metric(metrics, "zk_avg_fsynctime"),
+            "max_fsync": _metric(metrics, "zk_max_fsynctime"),
+        })
+
+    def summary(key, function):
+        values = [row[key] for row in rows if row[key] is not None]
+        return function(values) if values else None
+
+    total = {
+        "server": "all",
+        "address": "",
+        "state": str(len([row for row in rows if row["state"] in ("leader", "follower", "observer")])) + "/" +
+                 str(len(rows)) + " serving",
+        "avg_latency": summary("avg_latency", max),
+        "max_latency": summary("max_latency", max),
+        "outstanding_requests": summary("outstanding_requests", sum),
+        "znodes": summary("znodes", max),
+        "connections": summary("connections", sum),
+        "avg_fsync": summary("avg_fsync", max),
+        "max_fsync": summary("max_fsync", max),
+    }
+
+    if output_json:
+        print(json.dumps({"servers": rows, "ensemble": total}, indent=4))
+        return
+
+    columns = [("server", "ID", 6), ("address", "ADDRESS", 22), ("state", "STATE", 14),
+               ("avg_latency", "AVG LAT(ms)", 12), ("max_latency", "MAX LAT(ms)", 12),
+               ("outstanding_requests", "OUTSTANDING", 12), ("znodes", "ZNODES", 10),
+               ("connections", "CONNS", 8), ("avg_fsync", "AVG FSYNC(ms)", 14), ("max_fsync", "MAX FSYNC(ms)", 14)]
+    print("".join(title.ljust(width) for _, title, width in columns).rstrip())
+    for row in rows + [total]:
+        print("".join(("-" if row[key] is None else str(row[key])).ljust(width) for key, _, width in columns).rstrip())
+
+
+def bench(server, clients, operations, size, workloads, output_json):
+    if server is None:
+        client = utils.getClient()
+        container = utils.getContainer(client, CONTAINER_NAME)
+        if not container:
+            print("error: " + MODULE_NAME + " not found, use --server")
+            exit(-1)
+        address = _clientAddress(container)
+    else:
+        host, _, port = server.partition(":")
+        address = (host, int(port) if port else 2181)
+
+    for workload in workloads:
+        if workload not in BENCH_WORKLOADS:
+            print("error: unknown workload " + workload + ", use " + ",".join(BENCH_WORKLOADS))
+            exit(-1)
+
+    root = "/ignis-bench-" + utils.randomPassword()
+    payload = os.urandom(utils.parseSize(size))
+    sessions = list()
+    created = [set() for _ in range(clients)]
+    results = list()
+    try:
+        for _ in range(clients):
+            sessions.append(zookeeper_api.Client(*address))
+        sessions[0].create(root)
+
+        def run(workload, id):
+            zk = sessions[id]
+            times = list()
+            for i in range(operations):
+                path = root + "/" + str(id) + "-" + str(i)
+                t0 = time.perf_counter()
+                if workload == "create":
+                    zk.create(path, payload)
+                    created[id].add(path)
+                elif workload == "set":
+                    zk.setData(path, payload)
+                elif workload == "get":
+                    zk.getData(path)
+                else:
+                    zk.delete(path)
+                    created[id].discard(path)
+                times.append(time.perf_counter() - t0)
+            return times
+
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            if "create" not in workloads:
+                # The other workloads need the znodes, they are created without measuring
+                list(executor.map(lambda id: run("create", id), range(clients)))
+            for workload in BENCH_WORKLOADS:
+                if workload not in workloads:
+                    continue
+                times = list()
+                t0 = time.perf_counter()
+                for client_times in executor.map(lambda id: run(workload, id), range(clients)):
+                    times.extend(client_times)
+                elapsed = time.perf_counter() - t0
+                results.append({
+                    "operation": workload,
+                    "requests": len(times),
+                    "time": round(elapsed, 3),
+                    "ops": round(len(times) / elapsed, 1),
+                    "p50": round(utils.percentile(times, 50) * 1000, 3),
+                    "p90": round(utils.percentile(times, 90) * 1000, 3),
+                    "p99": round(utils.percentile(times, 99) * 1000, 3),
+                    "max": round(max(times) * 1000, 3),
+                })
+    finally:
+        # Cleanup is best effort, a failure must not hide the original error or leave sessions open
+        try:
+            for id, zk in enumerate(sessions):
+                for path in created[id]:
+                    try:
+                        zk.delete(path)
+                    except (zookeeper_api.ZookeeperError, OSError):
+                        pass
+            if sessions:
+                try:
+                    sessions[0].delete(root)
+                except (zookeeper_api.ZookeeperError, OSError):
+                    pass
+        finally:
+            for zk in sessions:
+                zk.close()
+
+    if output_json:
+        print(json.dumps({
+            "server": address[0] + ":" + str(address[1]),
+            "clients": clients,
+            "operations": operations,
+            "size": len(payload),
+            "results": results
+        }, indent=4))
+        return
+
+    print("OPERATION  CLIENTS  REQUESTS  TIME      OPS/S     p50        p90        p99        MAX")
+    for result in results:
+        print(result["operation"].ljust(10), str(clients).rjust(7), str(result["requests"]).rjust(9), "",
+              "{:.2f}s".format(result["time"]).ljust(9), str(result["ops"]).ljust(9),
+              *[utils.msFormat(result[key] / 1000).ljust(10) for key in ("p50", "p90", "p99")],
+              utils.msFormat(result["max"] / 1000))
+
+
+def _metric(metrics, key):
+    if key not in metrics:
+        return None
+    value = float(metrics[key])
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def _server(id, address, ports, observer):
+    return "server." + str(id) + "=" + address + ":" + str(ports[0]) + ":" + str(ports[1]) + \
+           (":observer" if observer else "") + ";" + str(ports[2])
+
+
+def _isMember(servers, server):
+    id, spec = server[len("server."):].split("=", 1)
+    if id not in servers:
+        return False
+    address = spec.split(";")[0].split(":")
+    current = servers[id].split(";")[0].split(":")
+    return current[:3] == address[:3] and _role(current) == _role(address)
+
+
+def _role(parts):
+    return parts[3] if len(parts) > 3 else "participant"
 
 
 def status():
-    client = docker.from_env()
+    client = utils.getClient()
     return utils.getStatus(client, CONTAINER_NAME)
 
 
+def probes():
+    client = utils.getClient()
+    container = utils.getContainer(client, CONTAINER_NAME)
+    if not container or container.status != "running":
+        return []
+    host, port = _clientAddress(container)
+    return [("ruok/mntr", lambda timeout: health.zookeeper(host, port, timeout))]
+
+
+def _clientAddress(container):
+    if CLIENT in container.labels:
+        host, port = container.labels[CLIENT].rsplit(":", 1)
+        return host, int(port)
+    return "localhost", utils.getHostPort(container, 2181) or 2181
+
+
 def resume():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.start())
 
 
 def stop():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.stop())
 
 
 def destroy():
-    client = docker.from_env()
+    client = utils.getClient()
     utils.containerAction(client, CONTAINER_NAME, MODULE_NAME, lambda container: container.remove(force=True))
@@ -0,0 +1,171 @@
+import socket
+import struct
+
+CONFIG_NODE = "/zookeeper/config"
+
+OK = 0
+SYSTEM_ERROR = -1
+CONNECTION_LOSS = -4
+UNIMPLEMENTED = -6
+BAD_ARGUMENTS = -8
+NEW_CONFIG_NO_QUORUM = -13
+RECONFIG_IN_PROGRESS = -14
+NO_NODE = -101
+NODE_EXISTS = -110
+NOT_EMPTY = -111
+NO_AUTH = -102
+BAD_VERSION = -103
+AUTH_FAILED = -115
+RECONFIG_DISABLED = -123
+ERRORS = {
+    SYSTEM_ERROR: "system error",
+    CONNECTION_LOSS: "connection loss",
+    UNIMPLEMENTED: "unimplemented",
+    BAD_ARGUMENTS: "bad arguments",
+    NEW_CONFIG_NO_QUORUM: "new config has no quorum",
+    RECONFIG_IN_PROGRESS: "reconfig in progress",
+    NO_NODE: "no node",
+    NODE_EXISTS: "node exists",
+    NOT_EMPTY: "node not empty",
+    NO_AUTH: "not authenticated",
+    BAD_VERSION: "config version changed",
+    AUTH_FAILED: "authentication failed",
+    RECONFIG_DISABLED: "reconfig disabled",
+}
+# Errors caused by a concurrent reconfig or a member that is still syncing, the operation can be retried
+CONFLICTS = [NEW_CONFIG_NO_QUORUM, RECONFIG_IN_PROGRESS, BAD_VERSION]
+
+_CREATE = 1
+_DELETE = 2
+_GET_DATA = 4
+_SET_DATA = 5
+_RECONFIG = 16
+_CLOSE = -11
+_AUTH = 100
+_AUTH_XID = -4
+_PERMS_ALL = 31
+_EPHEMERAL = 1
+
+
+class ZookeeperError(RuntimeError):
+    def __init__(self, code, operation):
+        RuntimeError.__init__(self, operation + ": " + ERRORS.get(code, "error " + str(code)))
+        self.code = code
+
+
+class Client:
+    def __init__(self, host, port, timeout=10, session_timeout=30000):
+        self.__sock = socket.create_connection((host, int(port)), timeout=timeout)
+        self.__xid = 0
+        try:
+            self.__send(struct.pack(">iqiq", 0, 0, session_timeout, 0) + _buffer(bytes(16)) + b"\0")
+            data = self.__recv()
+            _, negotiated = struct.unpack_from(">ii", data)
+            if negotiated <= 0:
+                raise ConnectionError(host + ":" + str(port) + " refused the session")
+        except Exception:
+            self.__sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        try:
+            self.__request(_CLOSE, b"", "close")
+        except Exception:
+            pass
+        self.__sock.close()
+
+    def addAuth(self, scheme, credential):
+        self.__send(struct.pack(">iii", _AUTH_XID, _AUTH, 0) + _string(scheme) + _buffer(credential.encode("utf-8")))
+        _, _, err = struct.unpack_from(">iqi", self.__recv())
+        if err != OK:
+            raise ZookeeperError(err, "auth")
+
+    def getData(self, path):
+        data = self.__request(_GET_DATA, _string(path) + b"\0", "get " + path)
+        return _readData(data)
+
+    def create(self, path, data=b"", ephemeral=False):
+        acl = struct.pack(">ii", 1, _PERMS_ALL) + _string("world") + _string("anyone")
+        body = _string(path) + _buffer(data) + acl + struct.pack(">i", _EPHEMERAL if ephemeral else 0)
+        data = self.__request(_CREATE, body, "create " + path)
+        size = struct.unpack_from(">i", data)[0]
+        return data[4:4 + size].decode("utf-8")
+
+    def setData(self, path, data, version=-1):
+        self.__request(_SET_DATA, _string(path) + _buffer(data) + struct.pack(">i", version), "set " + path)
+
+    def delete(self, path, version=-1):
+        self.__request(_DELETE, _string(path) + struct.pack(">i", version), "delete " + path)
+
+    def getConfig(self):
+        data, _ = self.getData(CONFIG_NODE)
+        return parseConfig(data.decode("utf-8"))
+
+    def reconfig(self, joining=None, leaving=None, members=None, version=-1):
+        body = _string(joining) + _string(leaving) + _string(members) + struct.pack(">q", version)
+        data, _ = _readData(self.__request(_RECONFIG, body, "reconfig"))
+        return parseConfig(data.decode("utf-8"))
+
+    def __request(self, op, body, operation):
+        self.__xid += 1
+        self.__send(struct.pack(">ii", self.__xid, op) + body)
+        while True:
+            data = self.__recv()
+            xid, _, err = struct.unpack_from(">iqi", data)
+            if xid == self.__xid:
+                break
+        if err != OK:
+            raise ZookeeperError(err, operation)
+        return data[16:]
+
+    def __send(self, data):
+        self.__sock.sendall(struct.pack(">i", len(data)) + data)
+
+    def __recv(self):
+        size = struct.unpack(">i", self.__recvAll(4))[0]
+        return self.__recvAll(size)
+
+    def __recvAll(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.__sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("zookeeper closed the connection")
+            data += chunk
+        return data
+
+
+def parseConfig(text):
+    servers = dict()
+    version = -1
+    for line in text.splitlines():
+        key, _, value = line.strip().partition("=")
+        if key.startswith("server."):
+            servers[key[len("server."):]] = value
+        elif key == "version":
+            version = int(value, 16)
+    return servers, version
+
+
+def _string(value):
+    if value is None:
+        return struct.pack(">i", -1)
+    return _buffer(value.encode("utf-8"))
+
+
+def _buffer(value):
+    return struct.pack(">i", len(value)) + value
+
+
+def _readData(data):
+    size = struct.unpack_from(">i", data)[0]
+    size = max(size, 0)
+    content = data[4:4 + size]
+    stat = struct.unpack_from(">qqqqiiiqiiq", data, 4 + size)
+    return content, {"mzxid": stat[1], "version": stat[4], "numChildren": stat[9]}
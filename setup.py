@@ -23,9 +23,10 @@ setuptools.setup(
         "Operating System :: POSIX :: Linux ",
     ],
     install_requires=[
-        'docker>=4.1.0',
+        'docker>=4.3.0',
         'python-hosts>=1.0',
-        'GitPython'
+        'GitPython',
+        'PyYAML'
     ],
     entry_points={
         'console_scripts': ['ignis-deploy=ignis.deploy.deploy:main'],
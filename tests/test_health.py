@@ -0,0 +1,163 @@
+import http.server
+import json
+import socketserver
+import threading
+import unittest
+import urllib.error
+
+import ignis.deploy.health as health
+
+TIMEOUT = 2
+
+
+class _TcpStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, answers=None, banner=None):
+        self.answers = answers or {}
+        self.banner = banner
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _TcpHandler)
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class _TcpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        if self.server.banner is not None:
+            self.request.sendall(self.server.banner)
+            return
+        command = self.request.recv(4).decode("utf-8")
+        self.request.sendall(self.server.answers.get(command, b""))
+
+
+class _HttpStub(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, routes):
+        self.routes = routes
+        http.server.ThreadingHTTPServer.__init__(self, ("127.0.0.1", 0), _HttpHandler)
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1])
+
+
+class _HttpHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, body = self.server.routes.get(self.path, (404, {}, b""))
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _mntr(**values):
+    return "".join("zk_" + key + "\t" + str(value) + "\n" for key, value in values.items()).encode("utf-8")
+
+
+class _StubTest(unittest.TestCase):
+    def stub(self, server):
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+
+class ZookeeperTest(_StubTest):
+
+    def test_four_letter_reads_the_whole_answer(self):
+        answer = b"x" * 10000
+        stub = self.stub(_TcpStub({"conf": answer}))
+        self.assertEqual(health.fourLetter("127.0.0.1", stub.port, "conf", TIMEOUT), answer.decode("utf-8"))
+
+    def test_ruok(self):
+        stub = self.stub(_TcpStub({"ruok": b"imok"}))
+        self.assertEqual(health.zookeeperPort("127.0.0.1", stub.port, TIMEOUT), "imok")
+
+    def test_ruok_not_whitelisted(self):
+        stub = self.stub(_TcpStub({"ruok": b"ruok is not executed because it is not in the whitelist.\n"}))
+        with self.assertRaisesRegex(RuntimeError, "whitelist"):
+            health.zookeeperPort("127.0.0.1", stub.port, TIMEOUT)
+
+    def test_mntr(self):
+        stub = self.stub(_TcpStub({"mntr": _mntr(server_state="follower", avg_latency=1) + b"no tab line\n"}))
+        metrics = health.mntr("127.0.0.1", stub.port, TIMEOUT)
+        self.assertEqual(metrics, {"zk_server_state": "follower", "zk_avg_latency": "1"})
+
+    def test_mntr_without_state(self):
+        stub = self.stub(_TcpStub({"mntr": b"This ZooKeeper instance is not currently serving requests\n"}))
+        with self.assertRaisesRegex(RuntimeError, "not currently serving"):
+            health.mntr("127.0.0.1", stub.port, TIMEOUT)
+
+    def test_leader(self):
+        stub = self.stub(_TcpStub({"ruok": b"imok",
+                                   "mntr": _mntr(server_state="leader", synced_followers=2, avg_latency=3)}))
+        self.assertEqual(health.zookeeper("127.0.0.1", stub.port, TIMEOUT),
+                         "leader, 2 synced followers, avg latency 3ms")
+
+    def test_without_quorum(self):
+        stub = self.stub(_TcpStub({"ruok": b"imok", "mntr": _mntr(server_state="looking")}))
+        with self.assertRaisesRegex(RuntimeError, "no quorum"):
+            health.zookeeper("127.0.0.1", stub.port, TIMEOUT)
+
+
+class SshTest(_StubTest):
+
+    def test_banner(self):
+        stub = self.stub(_TcpStub(banner=b"SSH-2.0-OpenSSH_9.6\r\n"))
+        self.assertEqual(health.ssh("127.0.0.1", stub.port, TIMEOUT), "SSH-2.0-OpenSSH_9.6")
+
+    def test_unexpected_banner(self):
+        stub = self.stub(_TcpStub(banner=b"HTTP/1.1 400 Bad Request\r\n"))
+        with self.assertRaisesRegex(RuntimeError, "unexpected banner"):
+            health.ssh("127.0.0.1", stub.port, TIMEOUT)
+
+
+class HttpTest(_StubTest):
+
+    def test_nomad_leader(self):
+        stub = self.stub(_HttpStub({"/v1/status/leader": (200, {}, b'"10.0.0.1:4647"')}))
+        self.assertEqual(health.nomad(stub.url, TIMEOUT), "leader 10.0.0.1:4647")
+
+    def test_nomad_without_leader(self):
+        stub = self.stub(_HttpStub({"/v1/status/leader": (200, {}, b'""')}))
+        with self.assertRaisesRegex(RuntimeError, "no leader"):
+            health.nomad(stub.url, TIMEOUT)
+
+    def test_registry(self):
+        stub = self.stub(_HttpStub({"/v2/": (200, {"Docker-Distribution-API-Version": "registry/2.0"}, b"{}")}))
+        self.assertEqual(health.registry(stub.url, TIMEOUT), "registry/2.0")
+
+    def test_registry_with_auth(self):
+        stub = self.stub(_HttpStub({"/v2/": (401, {"Docker-Distribution-API-Version": "registry/2.0"}, b"{}")}))
+        self.assertEqual(health.registry(stub.url, TIMEOUT), "registry/2.0")
+
+    def test_registry_error(self):
+        stub = self.stub(_HttpStub({"/v2/": (500, {}, b"")}))
+        with self.assertRaises(urllib.error.HTTPError):
+            health.registry(stub.url, TIMEOUT)
+
+    def test_mesos_master(self):
+        metrics = {"master/elected": 1, "master/slaves_active": 3}
+        stub = self.stub(_HttpStub({"/health": (200, {}, b""),
+                                    "/metrics/snapshot": (200, {}, json.dumps(metrics).encode("utf-8"))}))
+        self.assertEqual(health.mesosMaster(stub.url, TIMEOUT), "elected leader, 3 active agents")
+
+    def test_mesos_agent_not_registered(self):
+        stub = self.stub(_HttpStub({"/health": (200, {}, b""),
+                                    "/metrics/snapshot": (200, {}, b'{"slave/registered": 0}')}))
+        with self.assertRaisesRegex(RuntimeError, "not registered"):
+            health.mesosAgent(stub.url, TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import statistics
+import subprocess
+import sys
+import time
+import unittest
+
+# Time allowed on top of a bare interpreter start, importing docker alone takes longer
+STARTUP_BUDGET = 0.2
+RUNS = 5
+HEAVY_MODULES = ["docker", "git", "yaml"]
+
+_PARSE = """
+import sys
+import ignis.deploy.deploy as deploy
+sys.argv = ["ignis-deploy"] + sys.argv[1:]
+try:
+    deploy.cli()
+except SystemExit:
+    pass
+print("loaded:" + ",".join(module for module in {modules} if module in sys.modules))
+"""
+
+
+def _elapsed(args):
+    times = list()
+    for _ in range(RUNS):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable] + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_version_time(self):
+        overhead = _elapsed(["-m", "ignis.deploy.deploy", "version"]) - _elapsed(["-c", "pass"])
+        self.assertLess(overhead, STARTUP_BUDGET, "ignis-deploy version takes {:.3f}s".format(overhead))
+
+    def test_parse_without_heavy_imports(self):
+        import ignis.deploy.deploy as deploy
+        code = _PARSE.format(modules=repr(HEAVY_MODULES))
+        for argv in [["version"], ["apply", "-h"]] + [[name, "start", "-h"] for name, _, _ in deploy.SERVICES
+                                                     if name != "images"] + [["images", "build", "-h"]]:
+            result = subprocess.run([sys.executable, "-c", code] + argv, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, encoding="utf-8")
+            loaded = result.stdout.strip().splitlines()[-1][len("loaded:"):]
+            self.assertEqual(loaded, "", " ".join(argv) + " imports " + loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()